@@ -0,0 +1,94 @@
+import dataclasses
+import re
+from typing import TYPE_CHECKING, List, Optional
+
+from utils import estimate_tokens
+
+if TYPE_CHECKING:
+    # Only annotations use it; main.py builds policies without importing LangChain
+    from langchain_core.messages import BaseMessage
+
+# Longest excerpt of one message kept in the running summary
+MAX_SUMMARY_LINE_CHARS = 100
+
+
+@dataclasses.dataclass
+class HistoryState:
+    """Per-conversation bookkeeping of a `HistoryPolicy`."""
+    summary: str = ""
+    # Leading messages already folded into `summary`
+    summarized: int = 0
+    # Estimated prompt tokens not sent thanks to the policy, over all calls
+    tokens_saved: int = 0
+
+
+def _excerpt(text: str) -> str:
+    first_sentence = re.split(r"(?<=[.!?])\s", " ".join(text.split()), maxsplit=1)[0]
+    if len(first_sentence) <= MAX_SUMMARY_LINE_CHARS:
+        return first_sentence
+    return first_sentence[:MAX_SUMMARY_LINE_CHARS - 3].rstrip() + "..."
+
+
+def summarize_message(message: "BaseMessage") -> str:
+    """One summary line: who spoke and the first sentence of what they said or did."""
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        return "; ".join(
+            f"AI called {call['name']}({', '.join(f'{key}={value!r}' for key, value in call['args'].items())})"
+            for call in tool_calls
+        )
+    speaker = {"human": "Human", "ai": "AI", "tool": "Tool result"}.get(message.type, message.type)
+    return f"{speaker}: {_excerpt(str(message.content))}"
+
+
+class HistoryPolicy:
+    """
+    Bounds the conversation history sent with each prompt.
+
+    The last `window` messages are sent verbatim (all of them when `window`
+    is None). Messages that slide out of the window are folded into a
+    running summary, one line each, kept to at most `summary_tokens`
+    (newest lines first; 0 drops old messages without a summary). The
+    summary is only extended when the window moves, never rebuilt.
+    A window never starts on a tool result, so tool calls keep their outputs.
+    """
+
+    def __init__(self, window: Optional[int] = None, summary_tokens: int = 150):
+        if window is not None and window < 1:
+            raise ValueError(f"History window must be at least 1 message, got {window}")
+        self.window = window
+        self.summary_tokens = summary_tokens
+
+    def apply(self, messages: List["BaseMessage"], state: HistoryState) -> List["BaseMessage"]:
+        """The messages to send; updates `state` with the summary and the tokens saved."""
+        if self.window is None or len(messages) <= self.window:
+            return list(messages)
+
+        start = len(messages) - self.window
+        while start > 0 and messages[start].type == "tool":
+            start -= 1
+
+        if start > state.summarized:
+            if self.summary_tokens > 0:
+                lines = state.summary.splitlines() + [summarize_message(message) for message in messages[state.summarized:start]]
+                kept, used = [], 0
+                for line in reversed(lines):
+                    used += estimate_tokens(line)
+                    if used > self.summary_tokens:
+                        break
+                    kept.append(line)
+                state.summary = "\n".join(reversed(kept))
+            state.summarized = start
+
+        window = messages[start:]
+        full = sum(estimate_tokens(str(message.content)) for message in messages)
+        sent = sum(estimate_tokens(str(message.content)) for message in window) + estimate_tokens(state.summary)
+        state.tokens_saved += max(full - sent, 0)
+        return list(window)
+
+    @staticmethod
+    def summary_block(state: HistoryState) -> str:
+        """Text appended to a system prompt to carry the summary, empty without one."""
+        if not state.summary:
+            return ""
+        return f"\nEARLIER IN THIS CONVERSATION (summarized):\n{state.summary}\n"
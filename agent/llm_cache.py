@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+CACHE_MODES = ("record", "replay", "passthrough")
+
+
+def _serialize(generations: RETURN_VAL_TYPE) -> str:
+    return json.dumps([
+        {"message": message_to_dict(generation.message)} if isinstance(generation, ChatGeneration) else {"text": generation.text}
+        for generation in generations
+    ])
+
+
+def _deserialize(payload: str) -> RETURN_VAL_TYPE:
+    return [
+        ChatGeneration(message=messages_from_dict([item["message"]])[0]) if "message" in item else Generation(text=item["text"])
+        for item in json.loads(payload)
+    ]
+
+
+class CacheMissError(LookupError):
+    """Raised in replay mode when a prompt was never recorded."""
+
+
+class ResponseCache(BaseCache):
+    """
+    File-backed LLM response cache shared by the agent and the user simulator.
+
+    Entries are keyed by LangChain's `llm_string` (model name and call
+    parameters, including bound tools) and the serialized message list.
+
+    Modes:
+    - record: serve hits from the store and record every miss.
+    - replay: serve hits only; a miss raises `CacheMissError`, so no request
+      ever reaches the API and runs are offline and deterministic.
+    - passthrough: the cache is bypassed entirely.
+    """
+
+    def __init__(self, path: str = "./llm_cache.sqlite3", mode: str = "record"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode!r} (expected one of {CACHE_MODES})")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, generations TEXT)")
+        self._db.commit()
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.mode == "passthrough":
+            return None
+
+        with self._lock:
+            row = self._db.execute("SELECT generations FROM responses WHERE key = ?", (self._key(prompt, llm_string),)).fetchone()
+            if row is not None:
+                self.hits += 1
+                return _deserialize(row[0])
+            self.misses += 1
+
+        if self.mode == "replay":
+            raise CacheMissError("No recorded response for this prompt; re-run with --llm-cache record to capture it.")
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if self.mode != "record":
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, generations) VALUES (?, ?)",
+                (self._key(prompt, llm_string), _serialize(return_val)),
+            )
+            self._db.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
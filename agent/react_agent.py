@@ -1,12 +1,19 @@
 from typing import TypedDict, Annotated, List, Union, Literal
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, FunctionMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.caches import BaseCache
+from langchain_core.language_models import BaseChatModel
 from langchain_core.tools import tool
-from typing import List, Dict, Any, Tuple
+from langchain_core.runnables import RunnableLambda
+from typing import List, Dict, Any, Tuple, Optional
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 import operator
+from agent.history import HistoryPolicy, HistoryState
 from memory.memory import FreeBaoMemory
+from utils import lazy_import
+
+langchain_openai = lazy_import("langchain_openai")
 
 # --- Tools ---
 @tool
@@ -27,12 +34,24 @@ class AgentState(TypedDict):
     task: str
     context: str 
     steps: int
+    retrieval_candidates: int
+    # Bookkeeping of the history policy (see agent.history)
+    history_summary: str
+    history_summarized: int
+    history_tokens_saved: int
 
 # --- Agent Class ---
 class FreeBaoAgent:
-    def __init__(self, memory: FreeBaoMemory, model_name: str = "gpt-4o-mini"):
+    def __init__(self, memory: FreeBaoMemory, model_name: str = "gpt-4o-mini", retrieval_k: int = 1,
+                 context_token_budget: Optional[int] = None, cache: Optional[BaseCache] = None,
+                 llm: Optional[BaseChatModel] = None, history_policy: Optional[HistoryPolicy] = None):
         self.memory = memory
-        self.llm = ChatOpenAI(model=model_name, temperature=0).bind_tools(tools)
+        self.history_policy = history_policy or HistoryPolicy()
+        self.retrieval_k = retrieval_k
+        self.context_token_budget = context_token_budget
+        # A pre-built chat model (e.g. a local fake for benchmarks) replaces the OpenAI client
+        llm = llm if llm is not None else langchain_openai.ChatOpenAI(model=model_name, temperature=0, cache=cache)
+        self.llm = llm.bind_tools(tools)
         self.system_template = """You are a helpful and EFFICIENT assistant.
 Your goal is to solve the user's task with the MINIMUM number of turns.
 Avoid asking redundant questions. Infer what you can.
@@ -46,24 +65,42 @@ Current Task: {task}
 
     def retrieve_memory(self, state: AgentState):
         task = state["task"]
-        context = self.memory.get_formatted_retrieval(task, k=1)
-        return {"context": context}
+        context = self.memory.get_formatted_retrieval(task, k=self.retrieval_k, token_budget=self.context_token_budget)
+        return {"context": context, "retrieval_candidates": self.memory.last_retrieval_candidates()}
 
-    def reason(self, state: AgentState):
+    def route_entry(self, state: AgentState) -> Literal["retrieve", "reason"]:
+        # With a checkpointer the context survives between turns of a thread,
+        # so memory is only consulted on the first turn of each episode.
+        if state.get("context") is None:
+            return "retrieve"
+        return "reason"
+
+    def _prompt(self, state: AgentState) -> Tuple[List[BaseMessage], Dict[str, Any]]:
+        """The prompt for this step, plus the history bookkeeping to write back to the state."""
         messages = state["messages"]
         task = state["task"]
         context = state.get("context", "")
-        
-        # Ensure system message is first
-        if not isinstance(messages[0], SystemMessage):
-            system_msg = SystemMessage(content=self.system_template.format(context=context, task=task))
-            messages = [system_msg] + messages
-        else:
-            # Update system message content if needed
-            messages[0] = SystemMessage(content=self.system_template.format(context=context, task=task))
 
-        response = self.llm.invoke(messages)
-        return {"messages": [response], "steps": state.get("steps", 0) + 1}
+        # The system message is rebuilt on every step
+        if isinstance(messages[0], SystemMessage):
+            messages = messages[1:]
+        history = HistoryState(summary=state.get("history_summary", ""), summarized=state.get("history_summarized", 0))
+        messages = self.history_policy.apply(messages, history)
+        system_msg = SystemMessage(content=self.system_template.format(context=context, task=task) + HistoryPolicy.summary_block(history))
+
+        update = {"history_summary": history.summary, "history_summarized": history.summarized, "history_tokens_saved": history.tokens_saved}
+        return [system_msg] + messages, update
+
+    def reason(self, state: AgentState):
+        prompt, history = self._prompt(state)
+        response = self.llm.invoke(prompt)
+        return {"messages": [response], "steps": state.get("steps", 0) + 1, **history}
+
+    async def areason(self, state: AgentState):
+        """Async variant of `reason`, used when the graph is run with `ainvoke`."""
+        prompt, history = self._prompt(state)
+        response = await self.llm.ainvoke(prompt)
+        return {"messages": [response], "steps": state.get("steps", 0) + 1, **history}
 
     def should_continue(self, state: AgentState) -> Literal["tools", "__end__"]:
         messages = state["messages"]
@@ -77,15 +114,19 @@ Current Task: {task}
         # But for the graph, we just end the turn.
         return "__end__"
 
-    def build_graph(self):
+    def build_graph(self, checkpointer: Optional[BaseCheckpointSaver] = None):
+        """
+        Compiles the agent graph. Pass a checkpointer to keep per-thread state
+        between invocations; each turn then only needs to submit new messages.
+        """
         workflow = StateGraph(AgentState)
         
         workflow.add_node("retrieve", self.retrieve_memory)
-        workflow.add_node("reason", self.reason)
+        workflow.add_node("reason", RunnableLambda(self.reason, afunc=self.areason))
         tool_node = ToolNode(tools)
         workflow.add_node("tools", tool_node)
         
-        workflow.set_entry_point("retrieve")
+        workflow.set_conditional_entry_point(self.route_entry)
         workflow.add_edge("retrieve", "reason")
         
         workflow.add_conditional_edges(
@@ -94,4 +135,4 @@ Current Task: {task}
         )
         workflow.add_edge("tools", "reason")
         
-        return workflow.compile()
+        return workflow.compile(checkpointer=checkpointer)
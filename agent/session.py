@@ -0,0 +1,56 @@
+import time
+import uuid
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+from agent.react_agent import FreeBaoAgent
+
+
+class ChatSession:
+    """
+    One interactive conversation with the agent graph.
+
+    The graph is compiled with a checkpointer and every turn runs on the
+    same thread id, so the conversation, task and retrieved context carry
+    over between turns; each turn only submits the new user message.
+    Replies are streamed token by token (`stream_mode="messages"`).
+    """
+
+    def __init__(self, agent: FreeBaoAgent, thread_id: Optional[str] = None):
+        self.agent = agent
+        self.app = agent.build_graph(checkpointer=InMemorySaver())
+        self.config = {"configurable": {"thread_id": thread_id or f"ui-{uuid.uuid4().hex[:8]}"}}
+        self.turns = 0
+        self.last_latency: Dict[str, float] = {}
+
+    def stream_turn(self, user_input: str, retrieval: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, str, str]]:
+        """
+        Sends one user message and yields (node, message id, text) pieces of
+        the reply as they arrive: token chunks of the `reason` node and whole
+        tool outputs. The first message sets the task; `retrieval` supplies
+        its memory retrieval ({"context", "retrieval_candidates"}) when it was
+        already computed, and the `retrieve` node is then skipped.
+
+        Afterwards `last_latency` holds the seconds to the first streamed
+        text and to the end of the turn.
+        """
+        update: Dict[str, Any] = {"messages": [HumanMessage(content=user_input)]}
+        if self.turns == 0:
+            update.update(task=user_input, steps=0, **(retrieval or {}))
+
+        start = time.perf_counter()
+        first_token = None
+        for chunk, metadata in self.app.stream(update, self.config, stream_mode="messages"):
+            node = metadata.get("langgraph_node")
+            text = chunk.content if isinstance(chunk.content, str) else ""
+            if node not in ("reason", "tools") or not text:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            yield node, chunk.id, text
+
+        total = time.perf_counter() - start
+        self.turns += 1
+        self.last_latency = {"first_token_s": first_token if first_token is not None else total, "total_s": total}
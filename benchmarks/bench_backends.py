@@ -0,0 +1,141 @@
+"""
+Compares the Chroma and NumPy memory backends on synthetic episode stores.
+
+For every store size the collection is populated once, then reopened in a
+fresh subprocess so startup time and resident memory are measured cold.
+
+    uv run python -m benchmarks.bench_backends --sizes 1000 10000 --output backends.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+DIM = 384
+COLLECTION = "bench"
+
+
+def synthetic_rows(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(n, DIM)).astype(np.float32)
+    metadatas = [{"success": bool(i % 4), "turns": int(i % 15) + 1, "task": f"task {i % 97}"} for i in range(n)]
+    documents = [f"Agent Tool Call: book_flight\nTool Output: Booked #{i}" for i in range(n)]
+    return [str(i) for i in range(n)], embeddings, documents, metadatas
+
+
+def open_collection(backend: str, path: str):
+    if backend == "numpy":
+        from memory.numpy_store import NumpyCollection
+        return NumpyCollection(os.path.join(path, f"{COLLECTION}.npstore"))
+
+    import chromadb
+    from chromadb.config import Settings
+    client = chromadb.Client(Settings(persist_directory=path, is_persistent=True))
+    return client.get_or_create_collection(name=COLLECTION)
+
+
+def populate(backend: str, path: str, size: int, batch_size: int = 4096) -> float:
+    """Fills a store and returns the insert throughput in rows per second."""
+    ids, embeddings, documents, metadatas = synthetic_rows(size)
+    collection = open_collection(backend, path)
+    start = time.perf_counter()
+    for i in range(0, size, batch_size):
+        collection.add(
+            ids=ids[i:i + batch_size],
+            embeddings=embeddings[i:i + batch_size].tolist(),
+            documents=documents[i:i + batch_size],
+            metadatas=metadatas[i:i + batch_size],
+        )
+    return size / (time.perf_counter() - start)
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process, read from /proc on Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Fall back to the peak RSS (kilobytes on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(backend: str, path: str, queries: int, k: int) -> dict:
+    """Runs inside a fresh interpreter: startup, query latency and resident memory."""
+    # Import cost is paid before the clock starts so startup is the store alone
+    if backend == "chroma":
+        import chromadb  # noqa: F401
+    baseline_rss = current_rss_mb()
+
+    start = time.perf_counter()
+    collection = open_collection(backend, path)
+    startup = time.perf_counter() - start
+
+    rng = np.random.default_rng(1)
+    latencies = []
+    for _ in range(queries):
+        query = rng.normal(size=DIM).astype(np.float32).tolist()
+        start = time.perf_counter()
+        collection.query(query_embeddings=[query], n_results=k * 3, where={"success": True})
+        latencies.append(time.perf_counter() - start)
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "startup_s": startup,
+        "query_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "query_p99_ms": float(np.percentile(latencies_ms, 99)),
+        "rss_delta_mb": current_rss_mb() - baseline_rss,
+    }
+
+
+def run(sizes, backends, queries: int, k: int) -> list:
+    results = []
+    for size in sizes:
+        for backend in backends:
+            with tempfile.TemporaryDirectory() as path:
+                throughput = populate(backend, path, size)
+                worker = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_backends", "--worker", backend, path,
+                     "--queries", str(queries), "--k", str(k)],
+                    check=True, capture_output=True, text=True,
+                )
+                row = {"backend": backend, "size": size, "add_rows_per_s": throughput, **json.loads(worker.stdout)}
+                print(row, file=sys.stderr)
+                results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FreeBaoMemory vector-store backends")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--backends", nargs="+", choices=["chroma", "numpy"], default=["chroma", "numpy"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path")
+    parser.add_argument("--worker", nargs=2, metavar=("BACKEND", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.worker[0], args.worker[1], args.queries, args.k)))
+        return
+
+    results = run(args.sizes, args.backends, args.queries, args.k)
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Measures the memory and graph hot paths fully offline.
+
+Synthetic episode stores are built through `FreeBaoMemory.add_episodes`
+with a hash-seeded fake encoder, and the end-to-end episode loop runs
+`BenchmarkRunner` against scripted chat models with WandB disabled, so no
+API key or network access is needed.
+
+    uv run python -m benchmarks.bench_hot_paths --sizes 1000 100000 1000000 --output new.json
+    uv run python -m benchmarks.compare base.json new.json
+
+Metrics ending in `_per_s` are throughputs (higher is better); every other
+metric is a latency in milliseconds (lower is better).
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fakes import HashEncoder, ScriptedAgentModel, ScriptedUserModel
+from memory.memory import Episode, FreeBaoMemory, MAX_WRITE_BATCH
+
+CITIES = ["Paris", "Tokyo", "New York", "Berlin", "Rome", "Madrid", "Lisbon", "Seoul", "Cairo", "Lima"]
+ACTIONS = [
+    ("Book a flight to {city} for {n} passengers", "book_flight", "destination"),
+    ("Find a hotel in {city} for {n} nights", "search_hotels", "location"),
+    ("Book a table for {n} people in {city}", "book_restaurant", "location"),
+    ("Plan a {n}-day trip to {city}", "search_hotels", "location"),
+]
+
+
+def synthetic_tasks(count: int = 1000) -> list:
+    """`count` distinct task descriptions built from a few templates."""
+    tasks = []
+    n = 1
+    while len(tasks) < count:
+        for template, _, _ in ACTIONS:
+            for city in CITIES:
+                tasks.append(template.format(city=city, n=n))
+        n += 1
+    return tasks[:count]
+
+
+def synthetic_episodes(start: int, stop: int, tasks: list, seed: int = 0) -> list:
+    """Episodes `start..stop`; every one is distinct so none are deduplicated."""
+    rng = np.random.default_rng(seed + start)
+    episodes = []
+    for i in range(start, stop):
+        task_index = i % len(tasks)
+        _, tool, argument = ACTIONS[task_index % len(ACTIONS)]
+        city = CITIES[(task_index // len(ACTIONS)) % len(CITIES)]
+        turns = int(rng.integers(1, 16))
+        trajectory = (
+            f"User: {tasks[task_index]}\nAgent: Which dates work for you?\nUser: Next week.\n"
+            f"Agent Tool Call: {tool}({argument}='{city}', date='next week')\n"
+            f"Tool Output: Booked. Confirmation #{i:08d}. Details were sent by email.\n"
+            f"Agent: All set."
+        )
+        episodes.append(Episode(task_description=tasks[task_index], trajectory=trajectory,
+                                success=bool(rng.random() < 0.8), turns=turns))
+    return episodes
+
+
+def percentiles(latencies: list) -> tuple:
+    latencies_ms = np.asarray(latencies) * 1000
+    return float(np.percentile(latencies_ms, 50)), float(np.percentile(latencies_ms, 99))
+
+
+def build_store(memory: FreeBaoMemory, size: int, tasks: list) -> float:
+    """Fills the store through the batched write path; returns episodes per second."""
+    elapsed = 0.0
+    for start in range(0, size, MAX_WRITE_BATCH):
+        episodes = synthetic_episodes(start, min(start + MAX_WRITE_BATCH, size), tasks)
+        begin = time.perf_counter()
+        memory.add_episodes(episodes)
+        elapsed += time.perf_counter() - begin
+    return size / elapsed
+
+
+def bench_add_episode(memory: FreeBaoMemory, size: int, tasks: list, count: int) -> float:
+    episodes = synthetic_episodes(size, size + count, tasks, seed=1)
+    start = time.perf_counter()
+    for episode in episodes:
+        memory.add_episode(episode)
+    return count / (time.perf_counter() - start)
+
+
+def bench_retrieval(memory: FreeBaoMemory, tasks: list, queries: int, k: int, token_budget: int) -> dict:
+    rng = np.random.default_rng(2)
+    picks = [tasks[i] for i in rng.integers(0, len(tasks), size=queries)]
+    memory.encode_batch(sorted(set(picks)))  # query embeddings are warm, as after the first turn
+
+    timings = {"retrieve": [], "format": [], "format_budget": []}
+    for task in picks:
+        start = time.perf_counter()
+        memory.retrieve_pareto_efficient(task, k=k)
+        timings["retrieve"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        memory.get_formatted_retrieval(task, k=k)
+        timings["format"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        memory.get_formatted_retrieval(task, k=k, token_budget=token_budget)
+        timings["format_budget"].append(time.perf_counter() - start)
+
+    metrics = {}
+    for name, latencies in timings.items():
+        metrics[f"{name}_p50_ms"], metrics[f"{name}_p99_ms"] = percentiles(latencies)
+    return metrics
+
+
+def bench_runner(memory: FreeBaoMemory, episodes: int, k: int) -> float:
+    """Mean wall time of one eval episode through the compiled graph, in ms."""
+    from simulation.benchmark import BenchmarkRunner
+
+    runner = BenchmarkRunner(memory, project_name="bench_hot_paths", retrieval_k=k,
+                             agent_llm=ScriptedAgentModel(), user_llm=ScriptedUserModel())
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        runner.run_benchmark(num_episodes=episodes, mode="eval")
+        elapsed = time.perf_counter() - start
+    return elapsed / episodes * 1000
+
+
+def run(args) -> list:
+    tasks = synthetic_tasks(args.tasks)
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as path:
+            memory = FreeBaoMemory(collection_name="bench", persist_directory=path, backend=args.backend,
+                                   retrieval_mode=args.retrieval_mode, model=HashEncoder())
+            row = {"size": size, "add_episodes_per_s": build_store(memory, size, tasks)}
+            row["add_episode_per_s"] = bench_add_episode(memory, size, tasks, args.adds)
+            row.update(bench_retrieval(memory, tasks, args.queries, args.k, args.token_budget))
+            row["episode_overhead_ms"] = bench_runner(memory, args.episodes, args.k)
+            memory.close()
+        print(row, file=sys.stderr)
+        results.append(row)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FreeBaoMemory and graph hot paths offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default="numpy")
+    parser.add_argument("--retrieval-mode", choices=["weighted", "pareto"], default="weighted")
+    parser.add_argument("--tasks", type=int, default=1000, help="Distinct task descriptions in the store")
+    parser.add_argument("--adds", type=int, default=200, help="Single add_episode calls to time")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--token-budget", type=int, default=256)
+    parser.add_argument("--episodes", type=int, default=20, help="Eval episodes run through BenchmarkRunner")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    # The runner's WandB calls become no-ops
+    os.environ.setdefault("WANDB_MODE", "disabled")
+
+    payload = json.dumps({
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": run(args),
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measures CLI startup: per-module import time, which heavy dependencies an
+import drags in, and the time until `main.py --mode ui` shows its first prompt.
+
+Every measurement runs in a fresh interpreter so nothing is already imported.
+
+    uv run python -m benchmarks.bench_startup --runs 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+MODULES = ["main", "memory.memory", "agent.react_agent", "simulation.benchmark"]
+
+# Dependencies that must only be imported when they are first needed
+HEAVY_MODULES = ["torch", "sentence_transformers", "chromadb", "langchain_openai", "langgraph", "wandb", "pandas"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module: str) -> dict:
+    probe = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", probe], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def time_to_prompt(extra_args: list) -> float:
+    """Seconds from process start until the UI prints its first `User:` prompt."""
+    env = dict(os.environ, HF_HUB_OFFLINE="1")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "main.py", "--mode", "ui", *extra_args],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env,
+    )
+    seen = b""
+    while not seen.endswith(b"User: "):
+        char = process.stdout.read(1)
+        if not char:
+            raise RuntimeError(f"UI exited before prompting; output was {seen!r}")
+        seen += char
+    elapsed = time.perf_counter() - start
+    process.communicate(b"quit\n", timeout=60)
+    return elapsed
+
+
+def run(runs: int, ui_args: list) -> dict:
+    results = {}
+    for module in MODULES:
+        samples = [measure_import(module) for _ in range(runs)]
+        results[module] = {
+            "import_median_s": float(np.median([sample["seconds"] for sample in samples])),
+            "heavy_modules": samples[0]["heavy"],
+        }
+        print(module, results[module], file=sys.stderr)
+
+    prompt = [time_to_prompt(ui_args) for _ in range(runs)]
+    results["ui_time_to_prompt_median_s"] = float(np.median(prompt))
+    print("ui time to prompt", results["ui_time_to_prompt_median_s"], file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FREE-BAO CLI startup")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ui-args", nargs=argparse.REMAINDER, default=[], help="Extra arguments for main.py --mode ui")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    payload = json.dumps(run(args.runs, args.ui_args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
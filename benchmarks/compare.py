@@ -0,0 +1,62 @@
+"""
+Compares two `bench_hot_paths` result files and flags regressions.
+
+    uv run python -m benchmarks.compare base.json new.json --threshold 0.1
+
+Exits with status 1 if any metric got worse by more than the threshold.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List, Tuple
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_s")
+
+
+def compare(base: dict, new: dict, threshold: float) -> Tuple[List[dict], List[dict]]:
+    """Returns (all rows, regressed rows) for the metrics present in both runs."""
+    base_rows: Dict[int, dict] = {row["size"]: row for row in base["results"]}
+    rows, regressions = [], []
+    for new_row in new["results"]:
+        base_row = base_rows.get(new_row["size"])
+        if base_row is None:
+            continue
+        for metric, value in new_row.items():
+            if metric == "size" or metric not in base_row or not base_row[metric]:
+                continue
+            change = (value - base_row[metric]) / base_row[metric]
+            worse = -change if higher_is_better(metric) else change
+            row = {"size": new_row["size"], "metric": metric, "base": base_row[metric], "new": value, "change": change}
+            rows.append(row)
+            if worse > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two hot-path benchmark results")
+    parser.add_argument("base", type=str)
+    parser.add_argument("new", type=str)
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown tolerated per metric")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    rows, regressions = compare(base, new, args.threshold)
+    print(f"base {base.get('commit', '?')[:10]}  ->  new {new.get('commit', '?')[:10]}")
+    for row in rows:
+        flag = "  REGRESSION" if row in regressions else ""
+        print(f"{row['size']:>9} {row['metric']:<22} {row['base']:>12.3f} {row['new']:>12.3f} {row['change']:>+8.1%}{flag}")
+
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Deterministic local stand-ins for the embedding model and the chat models."""
+import hashlib
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from utils import estimate_tokens
+
+
+class HashEncoder:
+    """Maps each text to a fixed pseudo-random unit vector seeded by its hash."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.name = f"fake-hash/{dim}"
+
+    def encode(self, texts, batch_size: int = 64, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        vectors = np.stack([self._vector(text) for text in ([texts] if single else texts)])
+        return vectors[0] if single else vectors
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).normal(size=self.dim).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+
+def _usage(messages: List[BaseMessage], reply: str) -> dict:
+    prompt = sum(estimate_tokens(str(message.content)) for message in messages)
+    completion = estimate_tokens(reply)
+    return {"input_tokens": prompt, "output_tokens": completion, "total_tokens": prompt + completion}
+
+
+class ScriptedAgentModel(BaseChatModel):
+    """
+    Plays a two-turn agent: asks one clarifying question, then calls
+    `search_hotels` once the user answered, then wraps up after the tool output.
+    """
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        """Streams text replies word by word; tool calls arrive as one chunk."""
+        message = self._reply(messages)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_calls=message.tool_calls,
+                                                             usage_metadata=message.usage_metadata))
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if last else word + " ",
+                                                               usage_metadata=message.usage_metadata if last else None))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        if messages[-1].type == "tool":
+            message = AIMessage(content="Done, your hotel is booked.")
+        elif sum(1 for message in messages if message.type == "human") < 2:
+            message = AIMessage(content="Which city and which date?")
+        else:
+            message = AIMessage(content="", tool_calls=[{
+                "name": "search_hotels",
+                "args": {"location": "Paris", "date": "tomorrow"},
+                "id": f"call_{len(messages)}",
+            }])
+        message.usage_metadata = _usage(messages, str(message.content))
+        return message
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ScriptedAgentModel":
+        return self
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-agent"
+
+
+class ScriptedUserModel(BaseChatModel):
+    """Answers every agent message with the same goal details."""
+
+    reply: str = "Paris, tomorrow please."
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        message = AIMessage(content=self.reply, usage_metadata=_usage(messages, self.reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-user"
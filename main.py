@@ -1,50 +1,170 @@
 import argparse
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from utils import load_keys_from_bashrc
 from memory.memory import FreeBaoMemory
-from simulation.benchmark import BenchmarkRunner
-from agent.react_agent import FreeBaoAgent
+from memory.embedders import HashingEmbedder
+from agent.history import HistoryPolicy
+from simulation.datasets import DEFAULT_CHUNK_SIZE
 
-def main():
-    load_keys_from_bashrc()
-    
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="FREE-BAO: Contextual Experience Replay for Agents")
     parser.add_argument("--mode", choices=["ui", "benchmark"], default="benchmark", help="Mode to run")
     parser.add_argument("--benchmark-mode", choices=["warmup", "eval"], default="eval", help="benchmark phase")
     parser.add_argument("--episodes", type=int, default=5, help="Number of episodes")
     parser.add_argument("--warmup-episodes", type=int, default=0, help="Number of warmup episodes to run before eval")
-    parser.add_argument("--alpha", type=float, default=0.1, help="Pareto weight for efficiency (alpha)")
-    parser.add_argument("--dataset", type=str, default=None, help="Path to dataset file (csv/json)")
-    
-    args = parser.parse_args()
+    parser.add_argument("--alpha", type=float, default=None, help="Pareto weight for efficiency (default: the --load-snapshot alpha, else 0.1)")
+    parser.add_argument("--dataset", type=str, default=None, help="Path to dataset file (csv/json, or jsonl/parquet read lazily in chunks)")
+    parser.add_argument("--dataset-sample", type=float, default=None, help="Keep this fraction of the dataset rows, chosen deterministically by --dataset-seed")
+    parser.add_argument("--dataset-seed", type=int, default=0, help="Seed of the dataset sample")
+    parser.add_argument("--dataset-shard", type=str, default=None, help="Use only shard K of N of the (sampled) dataset, given as K/N")
+    parser.add_argument("--dataset-chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Dataset rows read (and prefetched in eval) per chunk")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of benchmark episodes run concurrently")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default="chroma", help="Vector store backing the memory")
+    parser.add_argument("--alpha-sweep", type=float, nargs="+", default=None, help="Run eval once per alpha, re-ranking one fetch of retrieval candidates")
+    parser.add_argument("--retrieval-mode", choices=["weighted", "pareto"], default="weighted", help="Weighted-score sort or layered Pareto fronts over (distance, turns)")
+    parser.add_argument("--candidate-pool", type=int, default=None, help="Number of retrieval candidates fetched per query")
+    parser.add_argument("--max-episodes", type=int, default=None, help="Memory capacity; dominated episodes are evicted beyond it")
+    parser.add_argument("--retrieval-k", type=int, default=1, help="Maximum number of retrieved examples per prompt")
+    parser.add_argument("--context-tokens", type=int, default=None, help="Token budget for retrieved examples; uses compact trajectories")
+    parser.add_argument("--persist-embeddings", action="store_true", help="Keep the embedding cache on disk next to the memory store")
+    parser.add_argument("--write-buffer-size", type=int, default=0, help="Warmup episodes buffered per batched memory write (default 0 writes immediately)")
+    parser.add_argument("--llm-cache", choices=["record", "replay", "passthrough"], default="passthrough", help="Record LLM responses, replay them offline, or bypass the cache")
+    parser.add_argument("--profile-dir", type=str, default=None, help="Run each benchmark phase under cProfile and write <mode>.prof here")
+    parser.add_argument("--llm-cache-path", type=str, default="./llm_cache.sqlite3", help="File backing the LLM response cache")
+    parser.add_argument("--results-dir", type=str, default="./results", help="Directory of the per-phase JSONL results logs")
+    parser.add_argument("--resume", action="store_true", help="Skip episodes already in the results log and fold them into the metrics")
+    parser.add_argument("--log-batch-size", type=int, default=50, help="Result rows per WandB table upload")
+    parser.add_argument("--warmup-shards", type=int, default=1, help="Run warmup in this many worker processes, each with its own memory shard, then merge")
+    parser.add_argument("--embedder", choices=["sentence-transformers", "hashing"], default="sentence-transformers", help="Embedding backend; 'hashing' needs no torch or model download")
+    parser.add_argument("--hashing-features", type=int, default=1024, help="Vector size of the hashing embedder")
+    parser.add_argument("--load-snapshot", type=str, default=None, help="Load a memory snapshot directory into the store before running")
+    parser.add_argument("--export-snapshot", type=str, default=None, help="Write the memory to a snapshot directory after the benchmark")
+    parser.add_argument("--history-window", type=int, default=None, help="Most recent messages sent verbatim to the agent and user simulator (default: all)")
+    parser.add_argument("--history-summary-tokens", type=int, default=150, help="Token cap of the running summary of messages outside the history window (0 disables it)")
+    parser.add_argument("--show-latency", action="store_true", help="UI mode: print time to first token and turn time after each reply")
+    parser.add_argument("--warm-up", choices=["background", "off"], default="background", help="Load the embedding model, memory store and (UI mode) agent graph on background threads at startup, or on first use")
+    return parser.parse_args(argv)
+
+
+def build_session(memory: FreeBaoMemory, args: argparse.Namespace, llm_cache, history_policy: HistoryPolicy):
+    """The UI's chat session; imports LangChain and LangGraph on first call."""
+    from agent.react_agent import FreeBaoAgent
+    from agent.session import ChatSession
+    agent = FreeBaoAgent(memory, retrieval_k=args.retrieval_k, context_token_budget=args.context_tokens, cache=llm_cache,
+                         history_policy=history_policy)
+    return ChatSession(agent)
+
+
+def main():
+    load_keys_from_bashrc()
+    args = parse_args()
+
+    llm_cache = None
+    if args.llm_cache != "passthrough":
+        from agent.llm_cache import ResponseCache
+        llm_cache = ResponseCache(args.llm_cache_path, mode=args.llm_cache)
+    if args.llm_cache == "replay":
+        # Replay never reaches OpenAI or WandB, so no real credentials are needed
+        os.environ.setdefault("OPENAI_API_KEY", "replay-offline")
+        os.environ.setdefault("WANDB_MODE", "offline")
     
-    memory = FreeBaoMemory(alpha=args.alpha)
+    embedder = HashingEmbedder(n_features=args.hashing_features) if args.embedder == "hashing" else None
+    memory_kwargs = dict(embedder=embedder, persist_embeddings=args.persist_embeddings, write_buffer_size=args.write_buffer_size,
+                         backend=args.backend, retrieval_mode=args.retrieval_mode, candidate_pool=args.candidate_pool,
+                         max_episodes=args.max_episodes)
+    if args.alpha is not None:
+        memory_kwargs["alpha"] = args.alpha
+    memory = FreeBaoMemory(**memory_kwargs)
+    if args.load_snapshot:
+        # An explicit --alpha wins over the one stored in the snapshot
+        loaded = memory.load_snapshot(args.load_snapshot, adopt_alpha=args.alpha is None)
+        print(f"Loaded {loaded} episodes from snapshot {args.load_snapshot}")
+    if args.warm_up == "background":
+        # Overlaps loading the embedding model with the graph imports below and the first prompt
+        memory.warm_up(background=True)
     
+    history_policy = HistoryPolicy(window=args.history_window, summary_tokens=args.history_summary_tokens)
+
+    # Heavy modules are imported only for the mode that needs them
     if args.mode == "benchmark":
-        runner = BenchmarkRunner(memory, dataset_path=args.dataset)
-        runner.run_benchmark(num_episodes=args.episodes, mode=args.benchmark_mode, warmup_episodes=args.warmup_episodes)
+        from simulation.benchmark import BenchmarkRunner
+        runner_kwargs = dict(dataset_path=args.dataset, retrieval_k=args.retrieval_k, context_token_budget=args.context_tokens,
+                             profile_dir=args.profile_dir, results_dir=args.results_dir, resume=args.resume, log_batch_size=args.log_batch_size,
+                             history_policy=history_policy, dataset_sample=args.dataset_sample, dataset_seed=args.dataset_seed,
+                             dataset_shard=tuple(int(part) for part in args.dataset_shard.split("/")) if args.dataset_shard else None,
+                             dataset_chunk_size=args.dataset_chunk_size)
+        warmup_episodes = args.episodes if args.benchmark_mode == "warmup" else args.warmup_episodes
+        sharded = args.warmup_shards > 1 and warmup_episodes > 0
+        if sharded:
+            from simulation.sharding import run_sharded_warmup
+            run_sharded_warmup(memory, warmup_episodes, args.warmup_shards, os.path.join(memory.persist_directory, "shards"),
+                               dict(memory_kwargs, alpha=memory.alpha, persist_directory=memory.persist_directory), runner_kwargs,
+                               llm_cache_args=(args.llm_cache_path, args.llm_cache) if llm_cache is not None else None,
+                               concurrency=args.concurrency)
+            warmup_episodes = 0
+        else:
+            warmup_episodes = args.warmup_episodes
+
+        if not (sharded and args.benchmark_mode == "warmup"):
+            runner = BenchmarkRunner(memory, llm_cache=llm_cache, **runner_kwargs)
+            if args.alpha_sweep and args.benchmark_mode == "eval":
+                runner.run_alpha_sweep(args.alpha_sweep, num_episodes=args.episodes, warmup_episodes=warmup_episodes, concurrency=args.concurrency)
+            else:
+                runner.run_benchmark(num_episodes=args.episodes, mode=args.benchmark_mode, warmup_episodes=warmup_episodes, concurrency=args.concurrency)
+        if args.export_snapshot:
+            print(f"Exported {memory.export_snapshot(args.export_snapshot)} episodes to snapshot {args.export_snapshot}")
         
     elif args.mode == "ui":
         print("Starting LangGraph UI mode (Simulated CLI for now)...")
-        agent = FreeBaoAgent(memory)
-        app = agent.build_graph()
-        
-        print("Ask me to book a flight or find a hotel!")
+
+        def retrieve(task: str):
+            context = memory.get_formatted_retrieval(task, k=args.retrieval_k, token_budget=args.context_tokens)
+            return {"context": context, "retrieval_candidates": memory.last_retrieval_candidates()}
+
+        # With background warm-up, LangChain/LangGraph import and the graph compiles
+        # while the user types the first message, and the first retrieval runs
+        # while that finishes.
+        executor = ThreadPoolExecutor(max_workers=2) if args.warm_up == "background" else None
+        pending_session = executor.submit(build_session, memory, args, llm_cache, history_policy) if executor else None
+        session = None
+
+        print("Ask me to book a flight or find a hotel! (`latency` toggles per-turn timings)")
+        show_latency = args.show_latency
         while True:
             try:
                 user_input = input("User: ")
                 if user_input.lower() in ["quit", "exit"]:
                     break
-                
-                # In a real UI, we'd maintain state across the loop
-                # Here we just show a single-turn invocation for demo
-                state = {"messages": [("user", user_input)], "task": user_input, "steps": 0}
-                for event in app.stream(state):
-                    for key, value in event.items():
-                        if "messages" in value:
-                            print(f"Agent ({key}): {value['messages'][-1].content}")
+                if user_input.lower() == "latency":
+                    show_latency = not show_latency
+                    print(f"Per-turn latency {'on' if show_latency else 'off'}")
+                    continue
+
+                retrieval = None
+                if session is None:
+                    if executor:
+                        pending_retrieval = executor.submit(retrieve, user_input)
+                        session = pending_session.result()
+                        retrieval = pending_retrieval.result()
+                    else:
+                        session = build_session(memory, args, llm_cache, history_policy)
+
+                current = None
+                for node, message_id, text in session.stream_turn(user_input, retrieval=retrieval):
+                    if (node, message_id) != current:
+                        print(("\n" if current else "") + f"Agent ({node}): ", end="")
+                        current = (node, message_id)
+                    print(text, end="", flush=True)
+                print()
+                if show_latency:
+                    latency = session.last_latency
+                    print(f"[first token {latency['first_token_s'] * 1000:.0f} ms, turn {latency['total_s'] * 1000:.0f} ms]")
             except KeyboardInterrupt:
                 break
+        if executor:
+            executor.shutdown(wait=False)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,39 @@
+import re
+
+TOOL_CALL_PREFIX = "Agent Tool Call: "
+TOOL_OUTPUT_PREFIX = "Tool Output: "
+
+# Longest argument value / tool output kept verbatim in the compact form
+MAX_ARG_CHARS = 40
+MAX_OUTPUT_CHARS = 80
+
+_ARGUMENT = re.compile(r"(\w+)=('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|[^,)]*)")
+
+
+def _shorten(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def _compact_call(call: str) -> str:
+    """Keeps the tool name and its arguments, clipping long argument values."""
+    name, _, args = call.partition("(")
+    if not args:
+        return name
+    arguments = [f"{key}={_shorten(value.strip(), MAX_ARG_CHARS)}" for key, value in _ARGUMENT.findall(args)]
+    return f"{name}({', '.join(arguments)})"
+
+
+def compact_trajectory(trajectory: str) -> str:
+    """
+    Reduces a trajectory to its actions: tool calls with their arguments and
+    the first sentence of each tool output. Agent and user chit-chat is dropped.
+    """
+    lines = []
+    for line in trajectory.splitlines():
+        if line.startswith(TOOL_CALL_PREFIX):
+            lines.append("Call: " + _compact_call(line[len(TOOL_CALL_PREFIX):].strip()))
+        elif line.startswith(TOOL_OUTPUT_PREFIX):
+            output = line[len(TOOL_OUTPUT_PREFIX):].strip()
+            first_sentence = re.split(r"(?<=[.!?])\s", output, maxsplit=1)[0]
+            lines.append("Result: " + _shorten(first_sentence, MAX_OUTPUT_CHARS))
+    return "\n".join(lines)
@@ -0,0 +1,116 @@
+import abc
+import hashlib
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import lazy_import
+
+sentence_transformers = lazy_import("sentence_transformers")
+sklearn_text = lazy_import("sklearn.feature_extraction.text")
+sklearn_decomposition = lazy_import("sklearn.decomposition")
+
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+class Embedder(abc.ABC):
+    """
+    Turns texts into float32 vectors for the memory store.
+
+    `name` identifies the embedding space; it keys the embedding cache and is
+    recorded in the collection metadata, so vectors from different embedders
+    are never compared against each other.
+    """
+
+    name: str = "embedder"
+
+    @abc.abstractmethod
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        """Returns one row per text."""
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """A sentence-transformers model, loaded on the first `encode` call."""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME):
+        self.model_name = model_name
+        self.name = f"sentence-transformers/{model_name}"
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = sentence_transformers.SentenceTransformer(self.model_name)
+        return self._model
+
+    def __getstate__(self):
+        # Worker processes reload the model themselves
+        return {"model_name": self.model_name}
+
+    def __setstate__(self, state):
+        self.__init__(state["model_name"])
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        return np.atleast_2d(np.asarray(self.model.encode(list(texts), batch_size=batch_size), dtype=np.float32))
+
+
+class HashingEmbedder(Embedder):
+    """
+    Torch-free embeddings from scikit-learn's `HashingVectorizer`.
+
+    Texts are hashed into `n_features` buckets of character n-grams (no
+    vocabulary, no model download) and L2-normalized. Optionally the sparse
+    vectors are projected onto `n_components` truncated-SVD directions
+    learned with `fit`; the projection is part of the embedder's identity.
+    """
+
+    def __init__(self, n_features: int = 1024, ngram_range: Tuple[int, int] = (2, 4), analyzer: str = "char_wb",
+                 components: Optional[np.ndarray] = None):
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.analyzer = analyzer
+        self.components = None if components is None else np.asarray(components, dtype=np.float32)
+        self._vectorizer = None
+
+    @property
+    def name(self) -> str:
+        name = f"hashing/{self.analyzer}-{self.ngram_range[0]}-{self.ngram_range[1]}-{self.n_features}"
+        if self.components is not None:
+            fingerprint = hashlib.sha256(self.components.tobytes()).hexdigest()[:12]
+            name += f"-svd{len(self.components)}-{fingerprint}"
+        return name
+
+    @property
+    def vectorizer(self):
+        if self._vectorizer is None:
+            self._vectorizer = sklearn_text.HashingVectorizer(
+                n_features=self.n_features, analyzer=self.analyzer, ngram_range=self.ngram_range,
+                alternate_sign=False, norm="l2", dtype=np.float32,
+            )
+        return self._vectorizer
+
+    def fit(self, texts: List[str], n_components: int = 128, seed: int = 0) -> "HashingEmbedder":
+        """Learns an SVD projection from a sample of texts (e.g. past task descriptions)."""
+        svd = sklearn_decomposition.TruncatedSVD(n_components=n_components, random_state=seed)
+        svd.fit(self.vectorizer.transform(texts))
+        self.components = svd.components_.astype(np.float32)
+        return self
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        hashed = self.vectorizer.transform(list(texts))
+        if self.components is None:
+            return hashed.toarray()
+
+        projected = np.asarray(hashed @ self.components.T, dtype=np.float32)
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        return projected / np.where(norms == 0, 1, norms)
+
+
+def embedder_name(embedder, default: str) -> str:
+    """The identity of any embedder-like object; plain `encode` models fall back to `default`."""
+    name = getattr(embedder, "name", None)
+    return name if isinstance(name, str) else default
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace so trivially different task strings share an entry."""
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for text embeddings.
+
+    Tier 1 is an in-process LRU bounded by `max_size` entries.
+    Tier 2 is an optional SQLite file that survives restarts.
+    Entries are keyed by the embedding model name and the normalized text.
+    """
+
+    def __init__(self, model_name: str, max_size: int = 1024, path: Optional[str] = None):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._db.commit()
+
+    def key(self, text: str) -> str:
+        payload = f"{self.model_name}\x00{normalize_text(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def set_model(self, model_name: str):
+        """
+        Switches the model whose embeddings are cached. The in-process tier is
+        dropped, since models without a name of their own share one.
+        """
+        with self._lock:
+            self.model_name = model_name
+            self._lru.clear()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.key(text)
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector: np.ndarray):
+        key = self.key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    (key, vector.tobytes()),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if self.max_size <= 0:
+            return
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._lru)}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
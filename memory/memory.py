@@ -1,10 +1,25 @@
-import chromadb
-from chromadb.config import Settings
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any, Tuple
+from utils import estimate_tokens, lazy_import
+from typing import List, Dict, Any, Tuple, Optional
 import dataclasses
+import hashlib
+import math
 import json
+import os
+import threading
+import time
+from memory.compaction import compact_trajectory
+from memory.embedders import DEFAULT_MODEL_NAME, Embedder, SentenceTransformerEmbedder, embedder_name
+from memory.embedding_cache import EmbeddingCache
+from memory.numpy_store import NumpyCollection
+from memory.snapshot import Snapshot, write_snapshot
+from memory.pareto import select_pareto, select_pareto_sweep, weighted_order, weighted_order_sweep, LeaderClusters, eviction_order
+
+# Imported on first use; the Chroma client is only needed by the 'chroma' backend
+chromadb = lazy_import("chromadb")
+
+# Embedder assumed for stores that predate recording it in the collection metadata
+LEGACY_EMBEDDER = f"sentence-transformers/{DEFAULT_MODEL_NAME}"
 
 @dataclasses.dataclass
 class Episode:
@@ -14,31 +29,400 @@ class Episode:
     turns: int
     metadata: Dict[str, Any] = dataclasses.field(default_factory=dict)
 
+# Upper bound on rows per collection.add call; Chroma rejects oversized batches.
+MAX_WRITE_BATCH = 4096
+
+# Past capacity, evict down to this fraction of `max_episodes` so the scan runs
+# once per ~10% of capacity worth of writes rather than on every write
+EVICTION_LOW_WATER = 0.9
+
+# Default widening of the candidate pool in 'pareto' retrieval mode
+PARETO_POOL_FACTOR = 100
+
 class FreeBaoMemory:
-    def __init__(self, collection_name: str = "free_bao_memory", persist_directory: str = "./memory_db", alpha: float = 0.1):
-        self.client = chromadb.Client(Settings(persist_directory=persist_directory, is_persistent=True))
-        self.collection = self.client.get_or_create_collection(name=collection_name)
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, collection_name: str = "free_bao_memory", persist_directory: str = "./memory_db", alpha: float = 0.1,
+                 embedding_cache_size: int = 1024, persist_embeddings: bool = False,
+                 write_buffer_size: int = 0, flush_interval: Optional[float] = None, encode_batch_size: int = 64,
+                 backend: str = "chroma", retrieval_mode: str = "weighted", candidate_pool: Optional[int] = None,
+                 max_episodes: Optional[int] = None, cluster_threshold: float = 0.15,
+                 model_name: str = DEFAULT_MODEL_NAME, model: Optional[Any] = None, embedder: Optional[Embedder] = None):
+        if backend not in ("chroma", "numpy"):
+            raise ValueError(f"Unknown memory backend: {backend!r} (expected 'chroma' or 'numpy')")
+        self.backend = backend
+        self.collection_name = collection_name
+        self.persist_directory = persist_directory
+
+        # The store and the embedding model are opened on first use (or by
+        # `warm_up`), so constructing the memory is cheap. `model` is kept for
+        # any object with a SentenceTransformer-style `encode(texts, batch_size=...)`.
+        if embedder is None:
+            embedder = model if model is not None else SentenceTransformerEmbedder(model_name)
+        self.embedder = embedder
+        self._default_embedder_name = f"sentence-transformers/{model_name}"
+        self.embedder_name = embedder_name(embedder, default=self._default_embedder_name)
+        self._client = None
+        self._collection = None
+        self._open_lock = threading.Lock()
         self.alpha = alpha
 
+        # 'weighted' sorts k * 3 candidates by distance + turns * alpha;
+        # 'pareto' layers non-dominated (distance, turns) fronts over `candidate_pool` candidates.
+        if retrieval_mode not in ("weighted", "pareto"):
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode!r} (expected 'weighted' or 'pareto')")
+        self.retrieval_mode = retrieval_mode
+        self.candidate_pool = candidate_pool
+
+        # Bounded capacity: past `max_episodes`, dominated episodes are evicted
+        # per cluster of similar tasks (cosine distance <= cluster_threshold).
+        self.max_episodes = max_episodes
+        self.cluster_threshold = cluster_threshold
+        self.evictions = 0
+        # Cluster label of each stored id, extended incrementally on eviction
+        self._clusters = LeaderClusters(cluster_threshold)
+        self._cluster_labels: Dict[str, int] = {}
+
+        # Task strings repeat across episodes and turns, so embeddings are cached
+        # in-process and optionally on disk next to the Chroma store.
+        cache_path = os.path.join(persist_directory, "embedding_cache.sqlite3") if persist_embeddings else None
+        self.embedding_cache = EmbeddingCache(self.embedder_name, max_size=embedding_cache_size, path=cache_path)
+        self.encode_batch_size = encode_batch_size
+
+        # Optional write buffer: episodes are held back and written in one batch
+        # once `write_buffer_size` is reached, or by the first `add_episode` call
+        # at least `flush_interval` seconds after the last flush. There is no
+        # timer: an idle buffer is only written by that next add, `flush` or `close`.
+        self.write_buffer_size = write_buffer_size
+        self.flush_interval = flush_interval
+        self._write_buffer: List[Episode] = []
+        self._last_flush = time.monotonic()
+        self._write_lock = threading.Lock()
+        self._collection_lock = threading.Lock()
+
+        self.reset_context_stats()
+
+        # Retrievals precomputed by `prefetch`, keyed by (task, k)
+        self._prefetched: Dict[Tuple[str, int], List[Dict[str, Any]]] = {}
+        # Candidate pools fetched by `prefetch`, keyed by (task, pool size)
+        self._candidate_pools: Dict[Tuple[str, int], Dict[str, Any]] = {}
+
+        # Candidate pool size of each thread's latest formatted retrieval
+        self._last_retrieval = threading.local()
+
+    # --- Lazily opened resources ---
+    @property
+    def client(self):
+        """The Chroma client, or None for the numpy backend."""
+        _ = self.collection  # opens the store on first access
+        return self._client
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            with self._open_lock:
+                if self._collection is None:
+                    self._collection = self._open_collection()
+        return self._collection
+
+    @collection.setter
+    def collection(self, collection):
+        self._collection = collection
+        self._clusters = LeaderClusters(self.cluster_threshold)
+        self._cluster_labels = {}
+
+    def _open_collection(self):
+        if self.backend == "numpy":
+            # Exact search over memory-mapped arrays; no Chroma client involved
+            collection = NumpyCollection(os.path.join(self.persist_directory, f"{self.collection_name}.npstore"))
+        else:
+            from chromadb.config import Settings
+            self._client = chromadb.Client(Settings(persist_directory=self.persist_directory, is_persistent=True))
+            collection = self._client.get_or_create_collection(name=self.collection_name)
+        self._check_embedder(collection)
+        return collection
+
+    def _check_embedder(self, collection):
+        """Records the embedder in a new collection's metadata and refuses a store built with another one."""
+        metadata = dict(collection.metadata or {})
+        recorded = metadata.get("embedder")
+        if recorded is None and collection.count() > 0:
+            # Stores written before embedders were recorded all used the default model
+            recorded = LEGACY_EMBEDDER
+        if recorded is None:
+            metadata["embedder"] = self.embedder_name
+            collection.modify(metadata=metadata)
+        elif recorded != self.embedder_name:
+            raise ValueError(
+                f"Collection {self.collection_name!r} was built with embedder {recorded!r}, not {self.embedder_name!r}; "
+                f"use a different collection_name or persist_directory for this embedder."
+            )
+
+    @property
+    def model(self):
+        """Alias of `embedder`, kept for callers that swap in their own encoder."""
+        return self.embedder
+
+    @model.setter
+    def model(self, model):
+        # The embedder name keys the embedding cache, so it follows the new encoder
+        self.embedder = model
+        self.embedder_name = embedder_name(model, default=self._default_embedder_name)
+        self.embedding_cache.set_model(self.embedder_name)
+
+    def warm_up(self, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Opens the store and loads the embedding model ahead of the first
+        query. With `background=True` this happens on a daemon thread, which
+        is returned; first use of either resource waits for it to finish.
+        """
+        def load():
+            _ = self.collection
+            self.embedder.encode(["warm-up"], batch_size=1)
+
+        if not background:
+            load()
+            return None
+        thread = threading.Thread(target=load, name="free-bao-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def encode(self, text: str) -> List[float]:
+        """Embeds a text, serving repeated texts from the embedding cache."""
+        return self.encode_batch([text])[0]
+
+    def encode_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embeds many texts with a single model call for the cache misses."""
+        vectors: List[Optional[np.ndarray]] = [self.embedding_cache.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+
+        if missing:
+            encoded = np.atleast_2d(np.asarray(
+                self.embedder.encode(missing, batch_size=self.encode_batch_size), dtype=np.float32
+            ))
+            fresh = dict(zip(missing, encoded))
+            for text, vector in fresh.items():
+                self.embedding_cache.put(text, vector)
+            vectors = [fresh[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+
+        return [vector.tolist() for vector in vectors]
+
+    def cache_stats(self) -> Dict[str, int]:
+        return self.embedding_cache.stats()
+
+    def close(self):
+        """Flushes pending writes and releases the on-disk embedding cache."""
+        self.flush()
+        self.embedding_cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def add_episode(self, episode: Episode):
-        """Adds an episode to the memory."""
-        embedding = self.model.encode(episode.task_description).tolist()
-        
-        # We store metadata for filtering and retrieval
-        metadata = {
+        """
+        Adds an episode to the memory, via the write buffer if one is configured.
+        `flush_interval` is checked here, so a due buffer is written on the next add.
+        """
+        if self.write_buffer_size <= 0 and self.flush_interval is None:
+            self.add_episodes([episode])
+            return
+
+        with self._write_lock:
+            self._write_buffer.append(episode)
+            due = len(self._write_buffer) >= max(self.write_buffer_size, 1) or (
+                self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered episodes to the collection."""
+        with self._write_lock:
+            pending, self._write_buffer = self._write_buffer, []
+            self._last_flush = time.monotonic()
+        if pending:
+            self.add_episodes(pending)
+
+    def add_episodes(self, episodes: List[Episode]):
+        """
+        Adds many episodes with one batched encode and one collection.upsert per chunk.
+        Ids are content hashes, so re-adding an episode overwrites it instead of duplicating it.
+        """
+        if not episodes:
+            return
+
+        # Identical episodes within one batch collapse to a single row
+        episodes = list({self._episode_id(episode): episode for episode in episodes}.values())
+        embeddings = self.encode_batch([episode.task_description for episode in episodes])
+
+        # Writers may run on several threads (concurrent warmup episodes)
+        with self._collection_lock:
+            self.clear_prefetch()
+            for start in range(0, len(episodes), MAX_WRITE_BATCH):
+                chunk = episodes[start:start + MAX_WRITE_BATCH]
+                self.collection.upsert(
+                    ids=[self._episode_id(episode) for episode in chunk],
+                    embeddings=embeddings[start:start + MAX_WRITE_BATCH],
+                    documents=[episode.trajectory for episode in chunk],
+                    metadatas=[self._episode_metadata(episode) for episode in chunk]
+                )
+            if self.max_episodes is not None:
+                self._enforce_capacity()
+
+    def _episode_id(self, episode: Episode) -> str:
+        # Stable across processes, unlike the salted built-in hash()
+        content = "\x00".join([episode.task_description, str(episode.turns), str(episode.success), episode.trajectory])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _enforce_capacity(self):
+        """
+        Once the collection exceeds `max_episodes`, evicts dominated episodes
+        down to the low-water mark. Only episodes stored since the last
+        eviction are embedded-fetched and assigned to clusters.
+        """
+        count = self.collection.count()
+        if count <= self.max_episodes:
+            return
+        target = math.ceil(self.max_episodes * EVICTION_LOW_WATER)
+
+        stored = self.collection.get(include=["metadatas"])
+        ids = stored['ids']
+        unseen = [id_ for id_ in ids if id_ not in self._cluster_labels]
+        for start in range(0, len(unseen), MAX_WRITE_BATCH):
+            chunk = unseen[start:start + MAX_WRITE_BATCH]
+            rows = self.collection.get(ids=chunk, include=["embeddings"])
+            self._cluster_labels.update(zip(rows['ids'], self._clusters.assign(np.asarray(rows['embeddings']))))
+
+        labels = np.array([self._cluster_labels[id_] for id_ in ids], dtype=np.int64)
+        success = np.array([bool(meta.get("success")) for meta in stored['metadatas']])
+        turns = np.array([meta.get("turns", 0) for meta in stored['metadatas']], dtype=np.float64)
+
+        victims = eviction_order(labels, success, turns)[:count - target]
+        self.collection.delete(ids=[ids[i] for i in victims])
+        self.evictions += len(victims)
+
+        # Forget evicted (and externally deleted) ids and clusters left empty
+        alive = np.ones(len(ids), dtype=bool)
+        alive[victims] = False
+        self._cluster_labels = {id_: int(label) for id_, label, kept in zip(ids, labels, alive) if kept}
+        self._clusters.prune(labels[alive])
+
+    def merge_from(self, shards: List["FreeBaoMemory"]) -> Dict[str, int]:
+        """
+        Copies the episodes of other memories (e.g. warmup shards) into this
+        one, reusing their stored embeddings.
+
+        Episodes count as duplicates when they share a task and a compact
+        trajectory, i.e. the same actions for the same task. Of each group only
+        the entry with the fewest turns is kept (successful entries first, and
+        entries already in this store win ties), so a faster duplicate from a
+        shard replaces a slower one here. Every shard must use this memory's embedder.
+        """
+        for shard in shards:
+            if shard.embedder_name != self.embedder_name:
+                raise ValueError(f"Cannot merge a shard embedded with {shard.embedder_name!r} into {self.embedder_name!r}")
+            shard.flush()
+        self.flush()
+
+        def key(id_: str, metadata: Dict[str, Any]) -> Tuple:
+            compact = metadata.get("compact_trajectory")
+            return (metadata.get("task"), compact) if compact is not None else ("id", id_)
+
+        def rank(metadata: Dict[str, Any]) -> Tuple:
+            return (not metadata.get("success"), metadata.get("turns", 0))
+
+        with self._collection_lock:
+            self.clear_prefetch()
+
+            # Winner per duplicate group: (rank, source shard or None for this store, id)
+            best: Dict[Tuple, Tuple[Tuple, Optional[int], str]] = {}
+            existing = self.collection.get(include=["metadatas"])
+            for id_, metadata in zip(existing['ids'], existing['metadatas']):
+                group = key(id_, metadata)
+                if group not in best or rank(metadata) < best[group][0]:
+                    best[group] = (rank(metadata), None, id_)
+
+            seen = len(existing['ids'])
+            for source, shard in enumerate(shards):
+                stored = shard.collection.get(include=["metadatas"])
+                seen += len(stored['ids'])
+                for id_, metadata in zip(stored['ids'], stored['metadatas']):
+                    group = key(id_, metadata)
+                    if group not in best or rank(metadata) < best[group][0]:
+                        best[group] = (rank(metadata), source, id_)
+
+            kept = {id_ for _, source, id_ in best.values() if source is None}
+            stale = [id_ for id_ in existing['ids'] if id_ not in kept]
+            for start in range(0, len(stale), MAX_WRITE_BATCH):
+                self.collection.delete(ids=stale[start:start + MAX_WRITE_BATCH])
+
+            copied = 0
+            for source, shard in enumerate(shards):
+                ids = [id_ for _, winner, id_ in best.values() if winner == source]
+                for start in range(0, len(ids), MAX_WRITE_BATCH):
+                    rows = shard.collection.get(ids=ids[start:start + MAX_WRITE_BATCH], include=["embeddings", "documents", "metadatas"])
+                    self.collection.upsert(ids=rows['ids'], embeddings=rows['embeddings'], documents=rows['documents'], metadatas=rows['metadatas'])
+                    copied += len(rows['ids'])
+
+            if self.max_episodes is not None:
+                self._enforce_capacity()
+
+        return {"copied": copied, "replaced": len(stale), "duplicates": seen - len(best), "size": self.collection.count()}
+
+    def export_snapshot(self, path: str) -> int:
+        """
+        Writes every stored episode to a snapshot directory (see
+        `memory.snapshot.write_snapshot`) together with the embedder name and
+        alpha. Returns the number of episodes written.
+        """
+        self.flush()
+        with self._collection_lock:
+            stored = self.collection.get(include=["embeddings", "documents", "metadatas"])
+        write_snapshot(path, stored['ids'], stored['embeddings'], stored['documents'], stored['metadatas'],
+                       manifest={"embedder": self.embedder_name, "alpha": self.alpha, "backend": self.backend})
+        return len(stored['ids'])
+
+    def load_snapshot(self, path: str, adopt_alpha: bool = True) -> int:
+        """
+        Adds the episodes of a snapshot, streaming them from its memory-mapped
+        files with their stored embeddings. The snapshot must come from the
+        same embedder. With `adopt_alpha` its alpha replaces this memory's;
+        otherwise this memory keeps its own alpha. Returns the number of
+        episodes loaded.
+        """
+        snapshot = Snapshot(path)
+        if snapshot.embedder != self.embedder_name:
+            raise ValueError(f"Snapshot {path!r} was built with embedder {snapshot.embedder!r}, not {self.embedder_name!r}")
+        if snapshot.alpha != self.alpha:
+            if adopt_alpha:
+                print(f"Using alpha={snapshot.alpha} from snapshot {path} (was {self.alpha})")
+                self.alpha = snapshot.alpha
+            else:
+                print(f"Warning: keeping alpha={self.alpha}; snapshot {path} was built with alpha={snapshot.alpha}")
+
+        self.flush()
+        with self._collection_lock:
+            self.clear_prefetch()
+            for batch in snapshot.batches(MAX_WRITE_BATCH):
+                self.collection.upsert(**batch)
+            if self.max_episodes is not None:
+                self._enforce_capacity()
+        return len(snapshot)
+
+    def eviction_stats(self) -> Dict[str, int]:
+        return {"evictions": self.evictions, "size": self.collection.count()}
+
+    def _episode_metadata(self, episode: Episode) -> Dict[str, Any]:
+        # We store metadata for filtering and retrieval. The compact trajectory
+        # is computed once here so token-budgeted prompts never re-derive it.
+        return {
             "success": episode.success,
             "turns": episode.turns,
             "task": episode.task_description,
+            "compact_trajectory": compact_trajectory(episode.trajectory),
             **episode.metadata
         }
-        
-        self.collection.add(
-            ids=[str(hash(episode.task_description + str(episode.turns) + episode.trajectory[:50]))], # Simple hash
-            embeddings=[embedding],
-            documents=[episode.trajectory],
-            metadatas=[metadata]
-        )
 
     def retrieve_pareto_efficient(self, task_description: str, k: int = 5) -> List[Dict[str, Any]]:
         """
@@ -49,48 +433,206 @@ class FreeBaoMemory:
         
         Uses a heuristic Pareto sort.
         """
-        query_embedding = self.model.encode(task_description).tolist()
-        
+        prefetched = self._prefetched.get((task_description, k))
+        if prefetched is not None:
+            return prefetched
+
+        return self.retrieve_pareto_efficient_batch([task_description], k)[0]
+
+    def retrieve_pareto_efficient_batch(self, tasks: List[str], k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Same as `retrieve_pareto_efficient`, but for many tasks with one encode and one query."""
+        if not tasks:
+            return []
+
+        pools = self._candidate_pools_for(tasks, k)
+        selections = [self._select_candidates(pool, k) for pool in pools]
+        return self._materialize(pools, selections)
+
+    def _pool_size(self, k: int) -> int:
+        # Large Pareto pools are fetched without documents (see `_query_candidates`)
+        return self.candidate_pool or k * (3 * PARETO_POOL_FACTOR if self.retrieval_mode == "pareto" else 3) # Fetch more to filter
+
+    def _candidate_pools_for(self, tasks: List[str], k: int) -> List[Dict[str, Any]]:
+        """Candidate pools of `tasks`, from the cache kept by `prefetch` where available."""
+        n_results = self._pool_size(k)
+        missing = [task for task in dict.fromkeys(tasks) if (task, n_results) not in self._candidate_pools]
+        queried = dict(zip(missing, self._query_candidates(missing, n_results))) if missing else {}
+        return [self._candidate_pools.get((task, n_results)) or queried[task] for task in tasks]
+
+    def _query_candidates(self, tasks: List[str], n_results: int) -> List[Dict[str, Any]]:
+        """
+        One encode and one query for every task. Each pool holds the ids,
+        metadatas, distances and turns of the successful candidates; its
+        documents are None when they are fetched only after selection.
+        """
+        query_embeddings = self.encode_batch(tasks)
+
+        # Large Pareto pools skip the documents in the query and only fetch
+        # the trajectories of the selected candidates afterwards.
+        defer_documents = self.retrieval_mode == "pareto"
+        include = ["metadatas", "distances"] if defer_documents else ["documents", "metadatas", "distances"]
+
         # 1. Fetch relevant successful candidates
         results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k * 3, # Fetch more to filter
-            where={"success": True}
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where={"success": True},
+            include=include
         )
-        
-        if not results['documents'][0]:
-            return []
 
-        candidates = []
-        for i, doc in enumerate(results['documents'][0]):
-            meta = results['metadatas'][0][i]
-            dist = results['distances'][0][i]
-            candidates.append({
-                "trajectory": doc,
-                "turns": meta["turns"],
-                "distance": dist,
-                "task": meta["task"]
-            })
-            
+        return [
+            {
+                "ids": results['ids'][row],
+                "metadatas": results['metadatas'][row],
+                "distances": np.asarray(results['distances'][row], dtype=np.float64),
+                "turns": np.fromiter((meta["turns"] for meta in results['metadatas'][row]), dtype=np.float64, count=len(results['metadatas'][row])),
+                "documents": None if defer_documents else results['documents'][row],
+            }
+            for row in range(len(tasks))
+        ]
+
+    def _materialize(self, pools: List[Dict[str, Any]], selections: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+        """Turns the selected positions of each pool into retrieval items."""
+        deferred = [pool['ids'][i] for pool, selected in zip(pools, selections) if pool['documents'] is None for i in selected]
+        by_id = {}
+        if deferred:
+            fetched = self.collection.get(ids=list(dict.fromkeys(deferred)), include=["documents"])
+            by_id = dict(zip(fetched['ids'], fetched['documents']))
+
+        def document_of(pool: Dict[str, Any], i: int) -> Optional[str]:
+            return by_id.get(pool['ids'][i]) if pool['documents'] is None else pool['documents'][i]
+
+        # Only the selected candidates are materialized as dicts
+        return [
+            [
+                {
+                    "trajectory": document_of(pool, i),
+                    "turns": pool['metadatas'][i]["turns"],
+                    "distance": float(pool['distances'][i]),
+                    "task": pool['metadatas'][i]["task"],
+                    "compact": pool['metadatas'][i].get("compact_trajectory"),
+                    "candidates": len(pool['ids']),
+                }
+                for i in selected
+            ]
+            for pool, selected in zip(pools, selections)
+        ]
+
+    def _select_candidates(self, pool: Dict[str, Any], k: int) -> np.ndarray:
+        """Returns the positions of the k best candidates, best first."""
+        if not pool['ids']:
+            return np.empty(0, dtype=np.int64)
+
+        if self.retrieval_mode == "pareto":
+            # Layer non-dominated fronts over (distance, turns) until k are filled
+            return select_pareto(pool['distances'], pool['turns'], k, self.alpha)
+
         # 2. Sort by simple weighted score (Similarity vs Efficiency)
         # Lower distance is better. Lower turns is better.
         # Score = Distance + (Turns * alpha)
         # This is a simplification of Pareto sorting for immediate practicality.
         # We value similarity highly, but penalties for turns apply.
-        
-        candidates.sort(key=lambda x: x['distance'] + (x['turns'] * self.alpha))
-        
-        return candidates[:k]
+        return weighted_order(pool['distances'], pool['turns'], self.alpha)[:k]
+
+    def sweep_alphas(self, tasks: List[str], alphas: List[float], k: int = 1) -> Dict[float, Dict[str, List[str]]]:
+        """
+        The episode ids each alpha would retrieve for each task. Every task's
+        candidate pool is fetched once (or taken from the `prefetch` cache)
+        and re-ranked for all alphas with vectorized scoring.
+        """
+        distinct = list(dict.fromkeys(tasks))
+        sweep = {alpha: {} for alpha in alphas}
+        for task, pool in zip(distinct, self._candidate_pools_for(distinct, k)):
+            if self.retrieval_mode == "pareto":
+                selections = select_pareto_sweep(pool['distances'], pool['turns'], k, alphas)
+            elif pool['ids']:
+                selections = weighted_order_sweep(pool['distances'], pool['turns'], alphas)[:, :k]
+            else:
+                selections = [[] for _ in alphas]
+            for alpha, selected in zip(alphas, selections):
+                sweep[alpha][task] = [pool['ids'][i] for i in selected]
+        return sweep
+
+    def prefetch(self, tasks: List[str], k: int = 1):
+        """
+        Precomputes retrievals for every distinct task in one batched query.
+        Subsequent `retrieve_pareto_efficient(task, k)` calls are served from
+        these results until the memory is written to or `clear_prefetch` is called.
+
+        The candidate pools behind them are cached until the memory is written
+        to, so prefetching again after changing `alpha` only re-ranks them.
+        """
+        distinct = list(dict.fromkeys(tasks))
+        if not distinct:
+            return
+        n_results = self._pool_size(k)
+        for task, pool in zip(distinct, self._candidate_pools_for(distinct, k)):
+            self._candidate_pools[(task, n_results)] = pool
+        for task, items in zip(distinct, self.retrieve_pareto_efficient_batch(distinct, k)):
+            self._prefetched[(task, k)] = items
 
-    def get_formatted_retrieval(self, task_description: str, k: int = 1) -> str:
+    def clear_prefetch(self, keep_candidates: bool = False):
+        """Drops prefetched retrievals; their candidate pools too unless `keep_candidates`."""
+        self._prefetched.clear()
+        if not keep_candidates:
+            self._candidate_pools.clear()
+
+    def get_formatted_retrieval(self, task_description: str, k: int = 1, token_budget: Optional[int] = None) -> str:
+        """
+        Formats up to k retrieved examples for the system prompt. With a
+        `token_budget`, examples use their compact trajectories and are added
+        best-first for as long as they fit in the budget.
+        """
         items = self.retrieve_pareto_efficient(task_description, k)
+        self._last_retrieval.candidates = items[0]["candidates"] if items else 0
         if not items:
             return ""
-        
-        formatted = "Here are efficient examples of how to solve similar tasks:\n\n"
+
+        header = "Here are efficient examples of how to solve similar tasks:\n\n"
+        raw = header + "".join(self._format_example(i, item, item['trajectory']) for i, item in enumerate(items))
+        if token_budget is None:
+            self._record_context_tokens(raw, raw)
+            return raw
+
+        formatted = header
+        used = estimate_tokens(header)
         for i, item in enumerate(items):
-            formatted += f"Example {i+1} (Solved in {item['turns']} turns):\n"
-            formatted += f"Task: {item['task']}\n"
-            formatted += f"Trajectory:\n{item['trajectory']}\n\n"
-            
+            example = self._format_example(i, item, item.get('compact') or compact_trajectory(item['trajectory']))
+            cost = estimate_tokens(example)
+            if used + cost > token_budget:
+                break
+            formatted += example
+            used += cost
+
+        if formatted == header:
+            formatted = ""
+        self._record_context_tokens(raw, formatted)
         return formatted
+
+    def last_retrieval_candidates(self) -> int:
+        """Candidates scored by the calling thread's most recent `get_formatted_retrieval`."""
+        return getattr(self._last_retrieval, "candidates", 0)
+
+    def _format_example(self, i: int, item: Dict[str, Any], trajectory: str) -> str:
+        formatted = f"Example {i+1} (Solved in {item['turns']} turns):\n"
+        formatted += f"Task: {item['task']}\n"
+        formatted += f"Trajectory:\n{trajectory}\n\n"
+        return formatted
+
+    def _record_context_tokens(self, raw: str, sent: str):
+        with self._write_lock:
+            self._context_tokens["retrievals"] += 1
+            self._context_tokens["raw"] += estimate_tokens(raw)
+            self._context_tokens["sent"] += estimate_tokens(sent)
+
+    def context_stats(self) -> Dict[str, float]:
+        """Average estimated prompt tokens per retrieval, with raw trajectories vs. as sent."""
+        retrievals = max(self._context_tokens["retrievals"], 1)
+        return {
+            "retrievals": self._context_tokens["retrievals"],
+            "raw_tokens": self._context_tokens["raw"] / retrievals,
+            "sent_tokens": self._context_tokens["sent"] / retrievals,
+        }
+
+    def reset_context_stats(self):
+        self._context_tokens = {"retrievals": 0, "raw": 0, "sent": 0}
@@ -0,0 +1,446 @@
+import contextlib
+import json
+import os
+import shutil
+import threading
+from typing import Iterator, List, Dict, Any, Optional
+
+import numpy as np
+
+# Metadata columns kept as memory-mapped arrays next to the embedding matrix
+COLUMNS = {"success": np.bool_, "turns": np.int32}
+# Text columns: UTF-8 blobs with memory-mapped row spans; `extra` holds the
+# metadata keys other than `task` as JSON
+TEXT_COLUMNS = ["ids", "documents", "task", "extra"]
+MIN_CAPACITY = 1024
+# Rows copied per batch when compacting
+COMPACT_BATCH = 4096
+
+
+class _TextColumn:
+    """
+    A mutable column of strings. Values are appended to one UTF-8 blob and
+    each row's (start, end) byte span is kept in a memory-mapped int64
+    array, like `memory.snapshot.TextColumn`; rewriting a row appends its new
+    value and leaves the old bytes for `compact`. Rows are decoded only when
+    they are read.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.blob_path = os.path.join(directory, f"{name}.utf8")
+        self.spans_path = os.path.join(directory, f"{name}.spans")
+        self.spans: Optional[np.memmap] = None
+        self.blob = np.empty(0, dtype=np.uint8)
+
+    def map(self, capacity: int):
+        self.spans = np.memmap(self.spans_path, dtype=np.int64, mode="r+", shape=(capacity, 2))
+        self._map_blob()
+
+    def _map_blob(self):
+        size = os.path.getsize(self.blob_path) if os.path.exists(self.blob_path) else 0
+        self.blob = np.memmap(self.blob_path, dtype=np.uint8, mode="r") if size else np.empty(0, dtype=np.uint8)
+
+    def unmap(self):
+        self.flush()
+        self.spans = None
+        self.blob = np.empty(0, dtype=np.uint8)
+
+    def grow(self, capacity: int):
+        with open(self.spans_path, "ab") as f:
+            f.truncate(capacity * 16)
+
+    def flush(self):
+        if self.spans is not None:
+            self.spans.flush()
+
+    def write(self, rows: np.ndarray, values: List[str]):
+        encoded = [value.encode("utf-8") for value in values]
+        with open(self.blob_path, "ab") as f:
+            start = f.tell()
+            for value in encoded:
+                f.write(value)
+        ends = start + np.cumsum([len(value) for value in encoded], dtype=np.int64)
+        self.spans[rows, 0] = ends - [len(value) for value in encoded]
+        self.spans[rows, 1] = ends
+        self._map_blob()
+
+    def __getitem__(self, row: int) -> str:
+        start, end = self.spans[row]
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    def values(self, rows: np.ndarray) -> List[str]:
+        """Many rows at once, copying the blob range that spans them in one go."""
+        if len(rows) == 0:
+            return []
+        spans = np.asarray(self.spans[rows])
+        low = int(spans[:, 0].min())
+        data = self.blob[low:int(spans[:, 1].max())].tobytes()
+        return [data[start:end].decode("utf-8") for start, end in (spans - low).tolist()]
+
+
+class _ReadWriteLock:
+    """Many concurrent readers or one writer; waiting writers block new readers."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextlib.contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class NumpyCollection:
+    """
+    A flat, exact vector store exposing the subset of the Chroma collection
+    API that FreeBaoMemory uses (`add`, `upsert`, `delete`, `query`, `get`,
+    `count`, `metadata`/`modify`).
+
+    Every column is memory-mapped from `path`: embeddings in one contiguous
+    float32 matrix, the filterable metadata (success, turns) in typed
+    arrays, and ids, documents, tasks and the remaining metadata in text
+    columns (see `_TextColumn`). Opening the store only builds the id index;
+    documents and metadata dicts are decoded for the rows a `get` or `query`
+    returns. Deleted rows are tombstoned and reclaimed by `compact`.
+    Distances are squared L2, matching Chroma's default space.
+
+    Writes remap, grow and swap the arrays, so every API call holds a
+    reader/writer lock: queries run concurrently, writes exclusively.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = _ReadWriteLock()
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.dim: Optional[int] = None
+        self._size = 0  # rows written, including tombstoned ones
+        self._capacity = 0
+        self._rows: Dict[str, int] = {}
+        self._embeddings: Optional[np.memmap] = None
+        self._sq_norms: Optional[np.memmap] = None
+        self._alive: Optional[np.memmap] = None
+        self._columns: Dict[str, np.memmap] = {}
+        self._text = {name: _TextColumn(self.path, name) for name in TEXT_COLUMNS}
+        self.ids = self._text["ids"]
+        self.documents = self._text["documents"]
+        self.metadata: Optional[Dict[str, Any]] = None
+
+    # --- Storage ---
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        if os.path.exists(self._file("metadata.json")):
+            with open(self._file("metadata.json"), "r") as f:
+                self.metadata = json.load(f)
+
+        header_path = self._file("header.json")
+        if not os.path.exists(header_path):
+            return
+
+        with open(header_path, "r") as f:
+            header = json.load(f)
+        self.dim = header["dim"]
+        self._size = header["size"]
+        self._capacity = header["capacity"]
+        self._map_arrays()
+
+        # Rows past `size` belong to a write that never committed its header
+        live = np.flatnonzero(self._alive[:self._size])
+        self._rows = dict(zip(self.ids.values(live), live.tolist()))
+
+    def _map_arrays(self):
+        shape = (self._capacity, self.dim)
+        self._embeddings = np.memmap(self._file("embeddings.f32"), dtype=np.float32, mode="r+", shape=shape)
+        self._sq_norms = np.memmap(self._file("sq_norms.f32"), dtype=np.float32, mode="r+", shape=(self._capacity,))
+        self._alive = np.memmap(self._file("alive.col"), dtype=np.bool_, mode="r+", shape=(self._capacity,))
+        self._columns = {
+            name: np.memmap(self._file(f"{name}.col"), dtype=dtype, mode="r+", shape=(self._capacity,))
+            for name, dtype in COLUMNS.items()
+        }
+        for column in self._text.values():
+            column.map(self._capacity)
+
+    def _unmap_arrays(self):
+        self._flush_arrays()
+        self._embeddings = self._sq_norms = self._alive = None
+        self._columns = {}
+        for column in self._text.values():
+            column.unmap()
+
+    def _reserve(self, rows: int):
+        if self._size + rows <= self._capacity:
+            return
+
+        capacity = max(MIN_CAPACITY, self._capacity * 2, self._size + rows)
+        self._unmap_arrays()
+
+        # Growing the files in place keeps existing rows where they are
+        itemsizes = {"embeddings.f32": 4 * self.dim, "sq_norms.f32": 4, "alive.col": 1}
+        itemsizes.update({f"{name}.col": np.dtype(dtype).itemsize for name, dtype in COLUMNS.items()})
+        for name, itemsize in itemsizes.items():
+            with open(self._file(name), "ab") as f:
+                f.truncate(capacity * itemsize)
+        for column in self._text.values():
+            column.grow(capacity)
+
+        self._capacity = capacity
+        self._map_arrays()
+
+    def _flush_arrays(self):
+        for array in [self._embeddings, self._sq_norms, self._alive, *self._columns.values()]:
+            if array is not None:
+                array.flush()
+        for column in self._text.values():
+            column.flush()
+
+    def _write_header(self):
+        tmp_path = self._file("header.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "size": self._size, "capacity": self._capacity}, f)
+        os.replace(tmp_path, self._file("header.json"))
+
+    def _write_rows(self, rows: np.ndarray, ids: List[str], vectors: np.ndarray,
+                    documents: List[str], metadatas: List[Dict[str, Any]]):
+        self._embeddings[rows] = vectors
+        self._sq_norms[rows] = np.einsum("ij,ij->i", vectors, vectors)
+        for name in COLUMNS:
+            self._columns[name][rows] = [metadata.get(name, 0) for metadata in metadatas]
+        self._text["ids"].write(rows, ids)
+        self._text["documents"].write(rows, [document or "" for document in documents])
+        self._text["task"].write(rows, [str(metadata.get("task", "")) for metadata in metadatas])
+        self._text["extra"].write(rows, [
+            json.dumps({key: value for key, value in metadata.items() if key != "task"}) for metadata in metadatas
+        ])
+        # A row goes live only once all its columns are written
+        self._alive[rows] = True
+        self._flush_arrays()
+        self._rows.update(zip(ids, rows.tolist()))
+
+    def _metadata(self, row: int) -> Dict[str, Any]:
+        metadata = json.loads(self._text["extra"][row])
+        metadata["task"] = self._text["task"][row]
+        return metadata
+
+    def _texts(self, name: str, rows: List[int], contiguous: bool) -> List[str]:
+        # Scans over most of the store copy the blob once instead of slicing it row by row
+        column = self._text[name]
+        return column.values(np.asarray(rows, dtype=np.int64)) if contiguous else [column[row] for row in rows]
+
+    def _vectors(self, embeddings: List[List[float]]) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimension {self.dim}")
+        return vectors
+
+    # --- Collection API ---
+    def count(self) -> int:
+        with self._lock.read():
+            return len(self._rows)
+
+    def modify(self, metadata: Dict[str, Any]):
+        """Replaces the collection-level metadata."""
+        with self._lock.write():
+            self._modify(metadata)
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict[str, Any]]):
+        with self._lock.write():
+            self._add(ids, embeddings, documents, metadatas)
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict[str, Any]]):
+        """Overwrites rows whose id already exists in place and appends the rest."""
+        with self._lock.write():
+            self._upsert(ids, embeddings, documents, metadatas)
+
+    def delete(self, ids: List[str]):
+        with self._lock.write():
+            self._delete(ids)
+
+    def compact(self):
+        """Rewrites the store without tombstoned rows or stale text."""
+        with self._lock.write():
+            self._compact()
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        with self._lock.read():
+            return self._get(ids, include)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10,
+              where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None) -> Dict[str, List[List[Any]]]:
+        with self._lock.read():
+            return self._query(query_embeddings, n_results, where, include)
+
+    # --- Unlocked implementations ---
+    def _modify(self, metadata: Dict[str, Any]):
+        tmp_path = self._file("metadata.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, self._file("metadata.json"))
+        self.metadata = dict(metadata)
+
+    def _add(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict[str, Any]]):
+        if not ids:
+            return
+
+        vectors = self._vectors(embeddings)
+        self._reserve(len(ids))
+        rows = np.arange(self._size, self._size + len(ids))
+        self._write_rows(rows, ids, vectors, documents, metadatas)
+        self._size += len(ids)
+        self._write_header()
+
+    def _upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict[str, Any]]):
+        if not ids:
+            return
+
+        vectors = self._vectors(embeddings)
+        existing = [i for i, id_ in enumerate(ids) if id_ in self._rows]
+        if existing:
+            self._write_rows(
+                np.array([self._rows[ids[i]] for i in existing]), [ids[i] for i in existing], vectors[existing],
+                [documents[i] for i in existing], [metadatas[i] for i in existing],
+            )
+
+        new = [i for i, id_ in enumerate(ids) if id_ not in self._rows]
+        if new:
+            self._add([ids[i] for i in new], vectors[new], [documents[i] for i in new], [metadatas[i] for i in new])
+
+    def _delete(self, ids: List[str]):
+        rows = [self._rows.pop(id_) for id_ in ids if id_ in self._rows]
+        if not rows:
+            return
+
+        self._alive[rows] = False
+        self._flush_arrays()
+
+        # Reclaim space once tombstones outnumber live rows
+        if self._size - len(self._rows) > max(len(self._rows), MIN_CAPACITY):
+            self._compact()
+
+    def _compact(self):
+        rows = np.flatnonzero(self._alive[:self._size])
+        shutil.rmtree(self.path + ".compact", ignore_errors=True)
+        staging = NumpyCollection(self.path + ".compact")
+        if self.metadata is not None:
+            staging.modify(metadata=self.metadata)
+        for start in range(0, len(rows), COMPACT_BATCH):
+            batch = rows[start:start + COMPACT_BATCH].tolist()
+            staging.add(
+                [self.ids[row] for row in batch], np.asarray(self._embeddings[batch]),
+                [self.documents[row] for row in batch], [self._metadata(row) for row in batch],
+            )
+
+        # Swap the directories, then reload from the compacted copy
+        staging._unmap_arrays()
+        self._unmap_arrays()
+        retired = self.path + ".retired"
+        os.replace(self.path, retired)
+        os.replace(staging.path, self.path)
+        shutil.rmtree(retired)
+        self._reset()
+        self._load()
+
+    def _get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        include = include or ["documents", "metadatas"]
+        if ids is not None:
+            rows = [self._rows[id_] for id_ in ids if id_ in self._rows]
+        else:
+            rows = np.flatnonzero(self._alive[:self._size]).tolist() if self._size else []
+        contiguous = ids is None
+
+        result: Dict[str, Any] = {"ids": self._texts("ids", rows, contiguous)}
+        if "documents" in include:
+            result["documents"] = self._texts("documents", rows, contiguous)
+        if "metadatas" in include:
+            result["metadatas"] = [
+                dict(json.loads(extra), task=task)
+                for extra, task in zip(self._texts("extra", rows, contiguous), self._texts("task", rows, contiguous))
+            ]
+        if "embeddings" in include:
+            result["embeddings"] = np.asarray(self._embeddings[rows]) if rows else np.empty((0, self.dim or 0), np.float32)
+        return result
+
+    def _query(self, query_embeddings: List[List[float]], n_results: int = 10,
+               where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None) -> Dict[str, List[List[Any]]]:
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        include = include or ["documents", "metadatas", "distances"]
+        results: Dict[str, List[List[Any]]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+
+        rows = self._filter(where)
+        if len(rows) == 0:
+            for key in results:
+                results[key] = [[] for _ in range(len(queries))]
+            return results
+
+        # Unfiltered queries use views of the memory map instead of a gathered copy
+        selected = slice(0, self._size) if len(rows) == self._size else rows
+
+        # Squared L2 via ||e||^2 - 2 e.q + ||q||^2, one matrix product for all queries
+        embeddings = self._embeddings[selected]
+        distances = self._sq_norms[selected][None, :] - 2.0 * (queries @ embeddings.T)
+        distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+        np.maximum(distances, 0.0, out=distances)
+
+        n = min(n_results, len(rows))
+        top = np.argpartition(distances, n - 1, axis=1)[:, :n]
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_distances = np.take_along_axis(top_distances, order, axis=1)
+
+        for hits, hit_distances in zip(rows[top].tolist(), top_distances):
+            results["ids"].append([self.ids[i] for i in hits])
+            if "documents" in include:
+                results["documents"].append([self.documents[i] for i in hits])
+            if "metadatas" in include:
+                results["metadatas"].append([self._metadata(i) for i in hits])
+            results["distances"].append(hit_distances.tolist())
+        return results
+
+    def _filter(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Returns the live row indices matching a simple equality `where` clause."""
+        if self._size == 0:
+            return np.empty(0, dtype=np.int64)
+
+        mask = np.array(self._alive[:self._size], dtype=bool)
+        for key, value in (where or {}).items():
+            if key in self._columns:
+                mask &= self._columns[key][:self._size] == value
+            else:
+                # Other keys decode the metadata of the rows still in the running
+                candidates = np.flatnonzero(mask)
+                mask[candidates] = [self._metadata(row).get(key) == value for row in candidates.tolist()]
+        return np.flatnonzero(mask)
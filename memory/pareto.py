@@ -0,0 +1,187 @@
+from typing import List, Optional
+
+import numpy as np
+
+
+def weighted_order(distances: np.ndarray, turns: np.ndarray, alpha: float) -> np.ndarray:
+    """Indices sorted by the scalarized score `distance + turns * alpha` (stable on ties)."""
+    return np.argsort(distances + turns * alpha, kind="stable")
+
+
+def pareto_front_ranks(distances: np.ndarray, turns: np.ndarray, max_fronts: int = -1) -> np.ndarray:
+    """
+    Assigns each candidate the index of its non-dominated front over
+    (distance, turns), both minimized. Front 0 is the Pareto frontier.
+
+    Candidates are sorted once and then peeled one front at a time; each
+    front is a single vectorized running-minimum pass. Peeling stops after
+    `max_fronts` fronts (all fronts if negative); unranked candidates are
+    left at -1.
+    """
+    ranks = np.full(len(distances), -1, dtype=np.int64)
+
+    # Sort once by distance, then turns; every subset stays in this order.
+    # A point is dominated iff some earlier point in the order has turns <= its
+    # own and is not an exact duplicate of it.
+    order = np.lexsort((turns, distances))
+    d_sorted, t_sorted = distances[order], turns[order]
+
+    # Exact duplicates are contiguous and share the fate of their first copy
+    duplicate = np.zeros(len(order), dtype=bool)
+    duplicate[1:] = (d_sorted[1:] == d_sorted[:-1]) & (t_sorted[1:] == t_sorted[:-1])
+    first_copy = np.maximum.accumulate(np.where(~duplicate, np.arange(len(order)), 0))
+
+    remaining = np.flatnonzero(~duplicate)
+    front = 0
+    while len(remaining) and front != max_fronts:
+        t = t_sorted[remaining]
+        prev_min = np.minimum.accumulate(np.concatenate(([np.inf], t[:-1])))
+        on_front = t < prev_min
+
+        ranks[order[remaining[on_front]]] = front
+        remaining = remaining[~on_front]
+        front += 1
+
+    if duplicate.any():
+        # Duplicates take the front of their first copy
+        ranks[order] = ranks[order[first_copy]]
+    return ranks
+
+
+def select_pareto(distances: np.ndarray, turns: np.ndarray, k: int, alpha: float) -> np.ndarray:
+    """
+    Picks k candidates by layering non-dominated fronts until k are filled.
+    Within a front, candidates are ordered by the weighted score.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    turns = np.asarray(turns, dtype=np.float64)
+    if len(distances) == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    # Only as many fronts as could possibly be needed are peeled
+    ranks = pareto_front_ranks(distances, turns, max_fronts=k)
+    ranked = np.flatnonzero(ranks >= 0)
+    order = np.lexsort((distances[ranked] + turns[ranked] * alpha, ranks[ranked]))
+    return ranked[order[:k]]
+
+
+def weighted_order_sweep(distances: np.ndarray, turns: np.ndarray, alphas: np.ndarray) -> np.ndarray:
+    """`weighted_order` for many alphas at once: one row of candidate indices per alpha."""
+    scores = np.asarray(distances)[None, :] + np.asarray(alphas, dtype=np.float64)[:, None] * np.asarray(turns)[None, :]
+    return np.argsort(scores, axis=1, kind="stable")
+
+
+def select_pareto_sweep(distances: np.ndarray, turns: np.ndarray, k: int, alphas: np.ndarray) -> List[np.ndarray]:
+    """
+    `select_pareto` for many alphas. The fronts do not depend on alpha, so
+    they are peeled once and only the within-front order is recomputed.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    turns = np.asarray(turns, dtype=np.float64)
+    if len(distances) == 0 or k <= 0:
+        return [np.empty(0, dtype=np.int64) for _ in alphas]
+
+    ranks = pareto_front_ranks(distances, turns, max_fronts=k)
+    ranked = np.flatnonzero(ranks >= 0)
+    return [ranked[np.lexsort((distances[ranked] + turns[ranked] * alpha, ranks[ranked]))[:k]] for alpha in alphas]
+
+
+def cluster_by_similarity(embeddings: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Greedy leader clustering on cosine distance: each unassigned vector in
+    turn becomes a leader and claims every unassigned vector within
+    `threshold` of it. Returns one cluster label per row.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    labels = np.full(len(embeddings), -1, dtype=np.int64)
+    if len(embeddings) == 0:
+        return labels
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.where(norms == 0, 1, norms)
+
+    cluster = 0
+    for leader in range(len(unit)):
+        if labels[leader] >= 0:
+            continue
+        unassigned = np.flatnonzero(labels < 0)
+        close = unassigned[1.0 - unit[unassigned] @ unit[leader] <= threshold]
+        labels[close] = cluster
+        labels[leader] = cluster
+        cluster += 1
+    return labels
+
+
+class LeaderClusters:
+    """
+    Incremental `cluster_by_similarity`: the leaders found so far are kept,
+    and new vectors join the nearest leader within `threshold`. Vectors no
+    leader claims are clustered greedily among themselves and their leaders
+    are added, so each vector is only compared against leaders once.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.leaders: Optional[np.ndarray] = None
+        self.leader_labels = np.empty(0, dtype=np.int64)
+        self._next_label = 0
+
+    def assign(self, embeddings: np.ndarray) -> np.ndarray:
+        """Cluster labels of `embeddings`, adding leaders as needed."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        labels = np.full(len(embeddings), -1, dtype=np.int64)
+        if len(embeddings) == 0:
+            return labels
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        unit = embeddings / np.where(norms == 0, 1, norms)
+        if self.leaders is not None and len(self.leaders):
+            similarity = unit @ self.leaders.T
+            nearest = np.argmax(similarity, axis=1)
+            claimed = 1.0 - similarity[np.arange(len(unit)), nearest] <= self.threshold
+            labels[claimed] = self.leader_labels[nearest[claimed]]
+
+        rest = np.flatnonzero(labels < 0)
+        if len(rest):
+            local = cluster_by_similarity(unit[rest], self.threshold)
+            # Greedy leaders are the first row of each local cluster
+            _, first = np.unique(local, return_index=True)
+            labels[rest] = local + self._next_label
+            new_leaders = unit[rest[first]]
+            self.leaders = new_leaders if self.leaders is None else np.vstack([self.leaders, new_leaders])
+            self.leader_labels = np.concatenate([self.leader_labels, local[first] + self._next_label])
+            self._next_label += len(first)
+        return labels
+
+    def prune(self, live_labels: np.ndarray):
+        """Drops the leaders of clusters that no longer have members."""
+        if self.leaders is None:
+            return
+        keep = np.isin(self.leader_labels, live_labels)
+        self.leaders = self.leaders[keep]
+        self.leader_labels = self.leader_labels[keep]
+
+
+def eviction_order(labels: np.ndarray, success: np.ndarray, turns: np.ndarray) -> np.ndarray:
+    """
+    Orders episodes from first to last to evict.
+
+    Within each cluster episodes are ranked successful-first, then by fewest
+    turns; rank 0 is the cluster's dominating episode. Failed episodes go
+    first, then higher ranks before lower ones (more turns first on ties),
+    so the dominating episode of a cluster is only evicted after every
+    dominated episode of every cluster.
+    """
+    labels = np.asarray(labels)
+    success = np.asarray(success, dtype=bool)
+    turns = np.asarray(turns, dtype=np.float64)
+
+    # Position of each episode within its cluster after sorting the cluster
+    within = np.lexsort((turns, ~success, labels))
+    sorted_labels = labels[within]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_labels[1:] != sorted_labels[:-1])))
+    group_start = np.repeat(starts, np.diff(np.concatenate((starts, [len(within)]))))
+    ranks = np.empty(len(labels), dtype=np.int64)
+    ranks[within] = np.arange(len(within)) - group_start
+
+    return np.lexsort((-turns, -ranks, success))
@@ -0,0 +1,131 @@
+import json
+import os
+import shutil
+from typing import Any, Dict, Iterator, List, Sequence
+
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+
+# Metadata fields stored as typed columns; any other keys go to the JSON `extra` column
+NUMERIC_COLUMNS = {"success": np.bool_, "turns": np.int32}
+TEXT_COLUMNS = ["task", "compact_trajectory"]
+
+
+class TextColumn:
+    """
+    A column of strings stored as one UTF-8 blob plus int64 row offsets.
+    Both files are memory-mapped; a row is decoded only when it is read.
+    """
+
+    def __init__(self, path: str, name: str):
+        self.offsets = np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode="r")
+        blob_path = os.path.join(path, f"{name}.utf8")
+        size = os.path.getsize(blob_path)
+        self.blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if size else np.empty(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def rows(self, start: int, stop: int) -> List[str]:
+        return [self[row] for row in range(start, stop)]
+
+    @staticmethod
+    def write(path: str, name: str, values: Sequence[str]):
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        np.save(os.path.join(path, f"{name}.offsets.npy"), offsets)
+        with open(os.path.join(path, f"{name}.utf8"), "wb") as f:
+            for value in encoded:
+                f.write(value)
+
+
+def write_snapshot(path: str, ids: List[str], embeddings: np.ndarray, documents: List[str],
+                   metadatas: List[Dict[str, Any]], manifest: Dict[str, Any]):
+    """
+    Writes a snapshot directory:
+    - manifest.json: format version, row count, dimension, plus `manifest`
+      (the embedder name and alpha)
+    - embeddings.npy: float32 (rows, dim)
+    - success.npy / turns.npy: typed metadata columns
+    - ids / documents / task / compact_trajectory / extra: text columns, `extra`
+      holding the remaining metadata keys as JSON
+
+    The snapshot is staged next to `path` and moved into place at the end.
+    """
+    staging = path.rstrip("/") + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1) if ids else np.empty((0, 0), dtype=np.float32)
+    np.save(os.path.join(staging, "embeddings.npy"), embeddings)
+    for name, dtype in NUMERIC_COLUMNS.items():
+        np.save(os.path.join(staging, f"{name}.npy"), np.array([metadata.get(name, 0) for metadata in metadatas], dtype=dtype))
+
+    TextColumn.write(staging, "ids", ids)
+    TextColumn.write(staging, "documents", [document or "" for document in documents])
+    for name in TEXT_COLUMNS:
+        TextColumn.write(staging, name, [str(metadata.get(name, "")) for metadata in metadatas])
+    known = set(NUMERIC_COLUMNS) | set(TEXT_COLUMNS)
+    TextColumn.write(staging, "extra", [
+        json.dumps({key: value for key, value in metadata.items() if key not in known}) for metadata in metadatas
+    ])
+
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump({"version": SNAPSHOT_VERSION, "count": len(ids), "dim": int(embeddings.shape[1]), **manifest}, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot written by `write_snapshot`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "manifest.json"), "r") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {self.manifest.get('version')!r} in {path}")
+
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self.columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in NUMERIC_COLUMNS}
+        self.ids = TextColumn(path, "ids")
+        self.documents = TextColumn(path, "documents")
+        self.text_columns = {name: TextColumn(path, name) for name in TEXT_COLUMNS + ["extra"]}
+
+    @property
+    def embedder(self) -> str:
+        return self.manifest["embedder"]
+
+    @property
+    def alpha(self) -> float:
+        return self.manifest["alpha"]
+
+    def __len__(self) -> int:
+        return self.manifest["count"]
+
+    def metadatas(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        metadatas = []
+        for row in range(start, stop):
+            metadata = json.loads(self.text_columns["extra"][row])
+            metadata.update({name: self.text_columns[name][row] for name in TEXT_COLUMNS})
+            metadata["success"] = bool(self.columns["success"][row])
+            metadata["turns"] = int(self.columns["turns"][row])
+            metadatas.append(metadata)
+        return metadatas
+
+    def batches(self, batch_size: int) -> Iterator[Dict[str, Any]]:
+        """Rows in chunks shaped like collection writes; embeddings are views of the memory map."""
+        for start in range(0, len(self), batch_size):
+            stop = min(start + batch_size, len(self))
+            yield {
+                "ids": self.ids.rows(start, stop),
+                "embeddings": self.embeddings[start:stop],
+                "documents": self.documents.rows(start, stop),
+                "metadatas": self.metadatas(start, stop),
+            }
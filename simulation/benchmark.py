@@ -1,11 +1,23 @@
-import wandb
-import pandas as pd
+import asyncio
+import itertools
+import os
 from tqdm import tqdm
 from agent.react_agent import FreeBaoAgent, AgentState
+from agent.history import HistoryPolicy, HistoryState
 from simulation.user_simulator import UserSimulator
-from memory.memory import FreeBaoMemory, Episode
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
-from typing import List
+from simulation.tracing import EpisodeTrace, aggregate_traces, profiled
+from memory.memory import FreeBaoMemory, Episode, MAX_WRITE_BATCH
+from simulation.results_log import ResultsLog
+from simulation.datasets import DEFAULT_CHUNK_SIZE, JsonlDataset, ListDataset, ParquetDataset, TaskDataset
+from langchain_core.caches import BaseCache
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import HumanMessage, AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from typing import Callable, Iterable, Iterator, List, Dict, Any, Optional, Tuple
+from utils import lazy_import
+
+wandb = lazy_import("wandb")
+pd = lazy_import("pandas")
 
 # --- Synthetic Dataset ---
 # --- Synthetic Dataset (Legacy) ---
@@ -34,145 +46,471 @@ USER_RL_TASKS = {
     ]
 }
 
+# UserRL spec: at most 15 interaction turns per episode
+MAX_TURNS = 15
+
+# Graph nodes and simulator calls timed by each episode's trace
+TRACED_STEPS = ["retrieve", "reason", "tools", "user_simulator"]
+TRACE_COLUMNS = [f"{name}_ms" for name in TRACED_STEPS] + ["prompt_tokens", "completion_tokens", "retrieval_candidates", "history_tokens_saved"]
+
+class ResultsUploader:
+    """
+    Uploads result rows to WandB in episode-index order, as tables of at most
+    `batch_size` rows. Each batch is a fresh table logged under its own key
+    (`results_table/<batch number>`) and dropped once logged, so only one
+    batch of rows is held at a time. A row that finishes ahead of a lower
+    index waits for it; rows of episodes resumed from the results log come
+    from `logged_row`.
+    """
+
+    def __init__(self, columns: List[str], batch_size: int, indices: List[int],
+                 logged_row: Callable[[int], Optional[List[Any]]]):
+        self.columns = columns
+        self.batch_size = batch_size
+        self.indices = indices
+        self.logged_row = logged_row
+        self.position = 0
+        self.pending: Dict[int, List[Any]] = {}
+        self._table = None
+        self._rows = 0
+        self._batches = 0
+
+    def add(self, index: int, row: List[Any]):
+        self.pending[index] = row
+        self.drain()
+
+    def drain(self):
+        while self.position < len(self.indices):
+            index = self.indices[self.position]
+            row = self.pending.pop(index, None)
+            if row is None:
+                row = self.logged_row(index)
+            if row is None:
+                break
+            if self._table is None:
+                self._table = wandb.Table(columns=self.columns)
+            self._table.add_data(*row)
+            self._rows += 1
+            self.position += 1
+            if self._rows >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if self._rows:
+            wandb.log({f"results_table/{self._batches}": self._table})
+            self._batches += 1
+        self._table = None
+        self._rows = 0
+
 class BenchmarkRunner:
-    def __init__(self, memory: FreeBaoMemory, project_name: str = "free_bao_benchmark", dataset_path: str = None):
+    def __init__(self, memory: FreeBaoMemory, project_name: str = "free_bao_benchmark", dataset_path: str = None, retrieval_k: int = 1,
+                 context_token_budget: Optional[int] = None, llm_cache: Optional[BaseCache] = None,
+                 agent_llm: Optional[BaseChatModel] = None, user_llm: Optional[BaseChatModel] = None,
+                 profile_dir: Optional[str] = None, results_dir: Optional[str] = None, resume: bool = False,
+                 log_batch_size: int = 50, history_policy: Optional[HistoryPolicy] = None,
+                 dataset_sample: Optional[float] = None, dataset_seed: int = 0, dataset_shard: Optional[Tuple[int, int]] = None,
+                 dataset_chunk_size: int = DEFAULT_CHUNK_SIZE):
         self.memory = memory
-        self.user_sim = UserSimulator()
+        self.profile_dir = profile_dir
+        self.results_dir = results_dir
+        self.resume = resume
+        self.log_batch_size = log_batch_size
+        self.retrieval_k = retrieval_k
+        self.llm_cache = llm_cache
+        self.user_sim = UserSimulator(cache=llm_cache, llm=user_llm, history_policy=history_policy)
+
+        # One agent and one compiled graph serve every episode. Conversation
+        # state lives in the checkpointer, keyed by a per-episode thread id.
+        self.agent = FreeBaoAgent(self.memory, retrieval_k=self.retrieval_k, context_token_budget=context_token_budget, cache=llm_cache,
+                                  llm=agent_llm, history_policy=history_policy)
+        self.checkpointer = InMemorySaver()
+        self.app = self.agent.build_graph(checkpointer=self.checkpointer)
         self.project_name = project_name
-        self.dataset = self.load_dataset(dataset_path)
+        self.dataset = self.load_dataset(dataset_path, sample=dataset_sample, seed=dataset_seed, shard=dataset_shard,
+                                         chunk_size=dataset_chunk_size)
 
-    def load_dataset(self, dataset_path: str = None) -> List[dict]:
+    def load_dataset(self, dataset_path: str = None, **kwargs: Any) -> TaskDataset:
+        """
+        Opens the benchmark tasks. JSONL and Parquet files are streamed in
+        chunks; the built-in sets, CSV and JSON are loaded whole. `kwargs`
+        (sample, seed, shard, chunk_size) go to the `TaskDataset`.
+        """
         if dataset_path in USER_RL_TASKS:
             print(f"Loading UserRL Benchmark: {dataset_path}")
-            return USER_RL_TASKS[dataset_path]
+            return ListDataset(USER_RL_TASKS[dataset_path], **kwargs)
         
         if dataset_path:
             # Simple assumption: CSV with 'goal' and 'task' columns
             # Or JSON list of dicts
-            if dataset_path.endswith(".csv"):
+            if dataset_path.endswith(".jsonl"):
+                 return JsonlDataset(dataset_path, **kwargs)
+            elif dataset_path.endswith(".parquet"):
+                 return ParquetDataset(dataset_path, **kwargs)
+            elif dataset_path.endswith(".csv"):
                  df = pd.read_csv(dataset_path)
-                 return df.to_dict(orient="records")
+                 return ListDataset(df.to_dict(orient="records"), **kwargs)
             elif dataset_path.endswith(".json"):
                  import json
                  with open(dataset_path, "r") as f:
-                     return json.load(f)
+                     return ListDataset(json.load(f), **kwargs)
             else:
                  print(f"Unknown file extension or dataset name for {dataset_path}, falling back to synthetic.")
-                 return TASKS
-        return TASKS
+                 return ListDataset(TASKS, **kwargs)
+        return ListDataset(TASKS, **kwargs)
 
-    def run_benchmark(self, num_episodes: int = 5, mode: str = "eval", warmup_episodes: int = 0):
+    def run_benchmark(self, num_episodes: int = 5, mode: str = "eval", warmup_episodes: int = 0, concurrency: int = 1,
+                      episode_indices: Optional[List[int]] = None):
         """
         Runs the benchmark.
         mode: 'warmup' (populate memory) or 'eval' (measure performance)
         warmup_episodes: Number of episodes to run as 'warmup' before starting 'eval'
+        concurrency: Number of episodes run concurrently (1 runs them sequentially)
+        episode_indices: Run only these episode indices of the main phase (e.g. one warmup shard)
+
+        With `profile_dir` set, each phase runs under cProfile and its stats are
+        written to `<profile_dir>/<mode>.prof`.
         """
         # If eval mode and warmup_episodes requested, run warmup first
         if mode == "eval" and warmup_episodes > 0:
             print(f"--- Starting INTERNAL WARMUP ({warmup_episodes} episodes) ---")
-            self._execute_phase(warmup_episodes, "warmup")
+            with profiled(self._profile_path("warmup")):
+                self._execute_phase(warmup_episodes, "warmup", concurrency)
             print(f"--- INTERNAL WARMUP COMPLETE ---\n")
 
         # Run the main phase
-        self._execute_phase(num_episodes, mode)
+        with profiled(self._profile_path(mode)):
+            self._execute_phase(num_episodes, mode, concurrency, episode_indices)
+
+    def run_alpha_sweep(self, alphas: List[float], num_episodes: int = 5, warmup_episodes: int = 0, concurrency: int = 1) -> List[Dict[str, Any]]:
+        """
+        Runs the eval phase once per alpha against the same memory.
+
+        Memory is read-only during eval, so each task's retrieval candidates
+        are fetched once, a dataset chunk at a time, and kept for the whole
+        sweep (also for streamed datasets); every alpha only re-ranks them.
+        Reports, per alpha, the eval metrics and how many tasks retrieve
+        different examples than under the first alpha.
+        """
+        if warmup_episodes > 0:
+            print(f"--- Starting INTERNAL WARMUP ({warmup_episodes} episodes) ---")
+            with profiled(self._profile_path("warmup")):
+                self._execute_phase(warmup_episodes, "warmup", concurrency)
+            print("--- INTERNAL WARMUP COMPLETE ---\n")
+
+        original_alpha = self.memory.alpha
+        rows = []
+        try:
+            # Fetch (and keep) each chunk's candidate pools; only their ids per alpha are compared
+            swept, changed = set(), {alpha: 0 for alpha in alphas}
+            for chunk in self._chunks(range(num_episodes)):
+                tasks = [task for task in dict.fromkeys(item["task"] for _, item in chunk) if task not in swept]
+                self.memory.prefetch(tasks, k=self.retrieval_k)
+                self.memory.clear_prefetch(keep_candidates=True)
+                selections = self.memory.sweep_alphas(tasks, alphas, k=self.retrieval_k)
+                for alpha in alphas:
+                    changed[alpha] += sum(1 for task in tasks if selections[alpha][task] != selections[alphas[0]][task])
+                swept.update(tasks)
+
+            for alpha in alphas:
+                print(f"--- Alpha sweep: alpha={alpha} ---")
+                self.memory.alpha = alpha
+                with profiled(self._profile_path(f"eval-alpha{alpha}")):
+                    metrics = self._execute_phase(num_episodes, "eval", concurrency, tag=f"alpha{alpha}", keep_candidates=True)
+                rows.append({"alpha": alpha, "changed_selections": changed[alpha], **metrics})
+        finally:
+            self.memory.alpha = original_alpha
+            self.memory.clear_prefetch()
+
+        run = wandb.init(project=self.project_name, job_type="alpha_sweep", config={"alphas": list(alphas)}, reinit=True)
+        columns = ["alpha", "changed_selections", "success_rate", "avg_turns"]
+        wandb.log({"alpha_sweep": wandb.Table(columns=columns, data=[[row[name] for name in columns] for row in rows])})
+        run.finish()
 
-    def _execute_phase(self, num_episodes: int, mode: str):
-        """Internal method to execute a specific benchmark phase."""
+        print(f"Alpha sweep over {len(swept)} tasks (selections compared with alpha={alphas[0]}):")
+        for row in rows:
+            print(f"  alpha={row['alpha']}: success rate {row['success_rate']:.2f}, avg turns {row['avg_turns']:.2f}, "
+                  f"changed selections {row['changed_selections']}")
+        return rows
+
+    def _profile_path(self, mode: str) -> Optional[str]:
+        return os.path.join(self.profile_dir, f"{mode}.prof") if self.profile_dir else None
+
+    def _execute_phase(self, num_episodes: int, mode: str, concurrency: int = 1, episode_indices: Optional[List[int]] = None,
+                       tag: Optional[str] = None, keep_candidates: bool = False) -> Dict[str, float]:
+        """
+        Internal method to execute a specific benchmark phase.
+
+        Each finished episode is appended to the phase's JSONL results log (with
+        `results_dir` set) and uploaded to WandB in tables of `log_batch_size`
+        rows; only the batch being filled (plus rows finished ahead of a lower
+        index) stays in memory, so trajectories are not held for the whole
+        phase. With `resume`,
+        episodes already in the log are skipped and their logged results count
+        towards the phase metrics. `tag` distinguishes the logs of repeated
+        phases (e.g. one per swept alpha); `keep_candidates` keeps every
+        chunk's candidate pools for them. Returns the eval metrics.
+        """
         run = wandb.init(project=self.project_name, job_type=mode, config={"alpha": self.memory.alpha}, reinit=True)
-        columns = ["task", "success", "turns", "trajectory", "mode"]
-        table = wandb.Table(columns=columns)
-        
-        results = []
-        
-        print(f"Starting {mode} phase with {num_episodes} episodes using {len(self.dataset)} tasks...")
+        columns = ["task", "success", "turns", "trajectory", "mode"] + TRACE_COLUMNS
+
+        log = ResultsLog(os.path.join(self.results_dir, f"{self.project_name}-{mode}{f'-{tag}' if tag else ''}.jsonl"), resume=self.resume) if self.results_dir else None
+        indices = list(range(num_episodes)) if episode_indices is None else list(episode_indices)
+        wanted = set(indices)
+        completed = {index: entry for index, entry in (log.completed.items() if log else []) if index in wanted}
+        summaries = {index: summary for index, (_, summary) in completed.items()}
+        remaining = [i for i in indices if i not in completed]
+        if completed:
+            print(f"Resuming {mode} phase: {len(completed)} of {len(indices)} episodes already in {log.path}")
+
+        uploader = ResultsUploader(
+            columns, self.log_batch_size, indices,
+            logged_row=lambda index: self._table_row(log.read(completed[index][0]), mode) if index in completed else None,
+        )
+        uploader.drain()
         
-        for i in range(num_episodes):
-            dataset_item = self.dataset[i % len(self.dataset)]
-            goal = dataset_item["goal"]
-            task = dataset_item["task"]
-            
-            agent = FreeBaoAgent(self.memory)
-            app = agent.build_graph()
-            
-            # Initial state
-            state = {
-                "messages": [HumanMessage(content=task)],
-                "task": task,
-                "steps": 0
-            }
-            
-            history: List[BaseMessage] = []
-            trajectory = ""
-            success = False
-            
-            # Interaction Loop (UserRL Spec: 15 turns max)
-            current_messages = [HumanMessage(content=task)]
-            
-            for step in range(15): 
-                # Agent acts
-                result = app.invoke({"messages": current_messages, "task": task})
-                
-                output_messages = result["messages"]
-                new_agent_messages = output_messages[len(current_messages):]
-                current_messages = output_messages # Update our view of state
-                
-                if not new_agent_messages:
-                    break
-                    
-                # Scan through new messages for ToolMessage indicating success
-                for msg in new_agent_messages:
-                    if hasattr(msg, "tool_calls") and msg.tool_calls:
-                         trajectory += f"Agent Tool Call: {msg.tool_calls[0]['name']}\n"
-                    elif msg.type == "tool":
-                        trajectory += f"Tool Output: {msg.content}\n"
-                        if "Booked" in str(msg.content) or "Found" in str(msg.content):
-                            success = True
-                    elif msg.type == "ai":
-                        trajectory += f"Agent: {msg.content}\n"
-                        if msg.content:
-                             history.append(msg)
-
-                if success:
-                    break
-                
-                # Get the final response text to send to user
-                last_response = ""
-                for msg in reversed(current_messages):
-                    if isinstance(msg, AIMessage) and msg.content:
-                        last_response = msg.content
-                        break
-                
-                # User Sim responds
-                user_response = self.user_sim.step(last_response, goal, history)
-                trajectory += f"User: {user_response}\n"
-                
-                user_msg = HumanMessage(content=user_response)
-                history.append(user_msg)
-                current_messages.append(user_msg)
-            
-            turns = step + 1
-            
-            # Log to WandB
-            table.add_data(task, success, turns, trajectory, mode)
-            results.append({"success": success, "turns": turns})
-            
-            # If warmup and successful, add to memory
-            if mode == "warmup" and success:
-                self.memory.add_episode(Episode(
-                    task_description=task,
-                    trajectory=trajectory,
-                    success=success,
-                    turns=turns,
-                    metadata={"goal": goal}
-                ))
+        print(f"Starting {mode} phase with {len(remaining)} episodes using {len(self.dataset)} tasks...")
+        self.memory.reset_context_stats()
+
+        if mode == "warmup" and completed:
+            self._restore_warmup_memory(log, completed)
+
+        def finish(episode: Dict[str, Any]):
+            trace = episode["trace"].summary()
+            if log is not None:
+                log.append({
+                    "index": episode["index"], "mode": mode, "task": episode["task"], "goal": episode["goal"],
+                    "success": episode["success"], "turns": episode["turns"], "trajectory": episode["trajectory"], "trace": trace,
+                })
+            summaries[episode["index"]] = {"success": episode["success"], "turns": episode["turns"], "trace": trace}
+            # Rows are uploaded in index order regardless of completion order
+            uploader.add(episode["index"], self._table_row(dict(episode, trace=trace), mode))
+
+        items = self._episode_items(remaining, mode, keep_candidates)
+        if concurrency > 1:
+            asyncio.run(self._run_episodes_async(items, mode, concurrency, finish))
+        else:
+            for i, item in items:
+                finish(self._run_episode(i, mode, item))
+
+        uploader.drain()
+        uploader.flush()
+        if log is not None:
+            log.close()
                 
-        wandb.log({"results_table": table})
+        # Write any episodes still held in the memory's write buffer
+        self.memory.flush()
+        # Candidate pools stay valid until the memory is written to
+        self.memory.clear_prefetch(keep_candidates=True)
+
+        results = [summaries[i] for i in indices]
+        wandb.log({f"embedding_cache_{name}": value for name, value in self.memory.cache_stats().items()})
+        wandb.log({f"memory_{name}": value for name, value in self.memory.eviction_stats().items()})
+
+        if self.llm_cache is not None and hasattr(self.llm_cache, "stats"):
+            wandb.log({f"llm_cache_{name}": value for name, value in self.llm_cache.stats().items()})
+
+        # Prompt tokens spent on retrieved examples: full trajectories vs. what was actually sent
+        context = self.memory.context_stats()
+        wandb.log({"context_tokens_raw": context["raw_tokens"], "context_tokens_sent": context["sent_tokens"]})
+        print(f"Retrieved context tokens per prompt - raw: {context['raw_tokens']:.0f}, sent: {context['sent_tokens']:.0f}")
+
+        # Where the time and tokens went: per-episode means and phase totals
+        phase_trace = aggregate_traces([r["trace"] for r in results])
+        wandb.log(phase_trace)
+        print("Per-episode time (ms) - " + ", ".join(
+            f"{name}: {phase_trace.get(f'trace_{name}_ms_per_episode', 0.0):.1f}" for name in TRACED_STEPS
+        ))
+        print("History tokens saved per episode - " + ", ".join(
+            f"{name}: {phase_trace.get(f'trace_{name}_history_tokens_saved_per_episode', 0.0):.0f}" for name in ["reason", "user_simulator"]
+        ))
         
+        metrics = {}
         if mode == "eval":
             avg_turns = sum(r["turns"] for r in results) / len(results)
             success_rate = sum(1 for r in results if r["success"]) / len(results)
-            wandb.log({"avg_turns": avg_turns, "success_rate": success_rate})
+            metrics = {"avg_turns": avg_turns, "success_rate": success_rate}
+            wandb.log(metrics)
             print(f"Eval Results - Avg Turns: {avg_turns}, Success Rate: {success_rate}")
             
         run.finish()
+        return metrics
+
+    def _chunks(self, indices: Iterable[int]) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+        """(index, task) of each episode, read from the dataset one chunk at a time."""
+        rows = self.dataset.rows(indices)
+        while True:
+            chunk = list(itertools.islice(rows, self.dataset.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _episode_items(self, indices: List[int], mode: str, keep_candidates: bool = False) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        (index, task) of each episode to run, chunk by chunk. Memory is
+        read-only during eval, so each chunk's retrievals are answered up
+        front with one batched query over its distinct tasks.
+        """
+        for chunk in self._chunks(indices):
+            if mode == "eval":
+                # Streamed datasets keep no candidate pools beyond the current chunk, unless asked to
+                self.memory.clear_prefetch(keep_candidates=self.dataset.in_memory or keep_candidates)
+                self.memory.prefetch([item["task"] for _, item in chunk], k=self.retrieval_k)
+            yield from chunk
+
+    def _table_row(self, record: Dict[str, Any], mode: str) -> List[Any]:
+        return [record["task"], record["success"], record["turns"], record["trajectory"], mode, *self._trace_row(record["trace"])]
+
+    def _restore_warmup_memory(self, log: ResultsLog, completed: Dict[int, Tuple[int, Dict[str, Any]]]):
+        """
+        Re-adds the logged successful warmup episodes. Writes are idempotent,
+        so this only restores episodes a crash kept in the write buffer.
+        """
+        batch = []
+        for offset, summary in completed.values():
+            if summary["success"]:
+                batch.append(self._to_memory_episode(log.read(offset)))
+            if len(batch) >= MAX_WRITE_BATCH:
+                self.memory.add_episodes(batch)
+                batch = []
+        self.memory.add_episodes(batch)
+
+    def _run_episode(self, index: int, mode: str, item: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Runs one episode with blocking graph and user simulator calls."""
+        episode = self._new_episode(index, item)
+        config = self._thread_config(episode, mode)
+        turn_input = {"messages": episode["messages"], "task": episode["task"]}
+
+        # Interaction Loop (UserRL Spec: 15 turns max)
+        for step in range(MAX_TURNS):
+            episode["turns"] = step + 1
+
+            # Agent acts on the thread state plus the new message only
+            result = self.app.invoke(turn_input, config)
+            if self._observe_agent_turn(episode, result):
+                break
+
+            # User Sim responds
+            with episode["trace"].timed("user_simulator"):
+                user_response = self.user_sim.step(self._last_agent_response(episode), episode["goal"], episode["history"],
+                                                   callbacks=config["callbacks"], history_state=episode["user_history"])
+            turn_input = {"messages": [self._observe_user_turn(episode, user_response)]}
+
+        self.checkpointer.delete_thread(config["configurable"]["thread_id"])
+        episode["trace"].count_tokens("user_simulator_history_tokens_saved", episode["user_history"].tokens_saved)
+
+        # If warmup and successful, add to memory (buffered and written in batches)
+        if mode == "warmup" and episode["success"]:
+            self.memory.add_episode(self._to_memory_episode(episode))
+        return episode
+
+    async def _run_episodes_async(self, items: Iterator[Tuple[int, Dict[str, Any]]], mode: str, concurrency: int,
+                                  on_finished: Callable[[Dict[str, Any]], None]):
+        # `concurrency` workers pull episodes from the shared iterator as they
+        # free up, so only the episodes in flight are materialized
+        async def worker():
+            for index, item in items:
+                on_finished(await self._arun_episode(index, mode, item))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def _arun_episode(self, index: int, mode: str, item: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Async variant of `_run_episode` used for concurrent execution."""
+        episode = self._new_episode(index, item)
+        config = self._thread_config(episode, mode)
+        turn_input = {"messages": episode["messages"], "task": episode["task"]}
+
+        for step in range(MAX_TURNS):
+            episode["turns"] = step + 1
+
+            result = await self.app.ainvoke(turn_input, config)
+            if self._observe_agent_turn(episode, result):
+                break
+
+            with episode["trace"].timed("user_simulator"):
+                user_response = await self.user_sim.astep(self._last_agent_response(episode), episode["goal"], episode["history"],
+                                                          callbacks=config["callbacks"], history_state=episode["user_history"])
+            turn_input = {"messages": [self._observe_user_turn(episode, user_response)]}
+
+        await self.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+        episode["trace"].count_tokens("user_simulator_history_tokens_saved", episode["user_history"].tokens_saved)
+
+        # Memory writes are serialized inside FreeBaoMemory; run them off the event loop
+        if mode == "warmup" and episode["success"]:
+            await asyncio.to_thread(self.memory.add_episode, self._to_memory_episode(episode))
+        return episode
+
+    def _thread_config(self, episode: Dict[str, Any], mode: str) -> Dict[str, Any]:
+        return {"configurable": {"thread_id": f"{mode}-{episode['index']}"}, "callbacks": [episode["trace"]]}
+
+    def _new_episode(self, index: int, dataset_item: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if dataset_item is None:
+            dataset_item = self.dataset[index]
+        task = dataset_item["task"]
+        return {
+            "index": index,
+            "task": task,
+            "goal": dataset_item["goal"],
+            "messages": [HumanMessage(content=task)],
+            "history": [],
+            "user_history": HistoryState(),
+            "trajectory": "",
+            "success": False,
+            "turns": 0,
+            "trace": EpisodeTrace(),
+        }
+
+    def _trace_row(self, trace: Dict[str, float]) -> List[float]:
+        prompt = sum(value for name, value in trace.items() if name.endswith("_prompt_tokens"))
+        completion = sum(value for name, value in trace.items() if name.endswith("_completion_tokens"))
+        saved = sum(value for name, value in trace.items() if name.endswith("_history_tokens_saved"))
+        return [trace.get(f"{name}_ms", 0.0) for name in TRACED_STEPS] + [prompt, completion, trace["retrieval_candidates"], saved]
+
+    def _observe_agent_turn(self, episode: Dict[str, Any], result: Dict[str, Any]) -> bool:
+        """Records the agent's new messages. Returns True when the episode is over."""
+        output_messages = result["messages"]
+        new_agent_messages = output_messages[len(episode["messages"]):]
+        episode["messages"] = output_messages # Update our view of state
+        
+        if not new_agent_messages:
+            return True
+            
+        # Scan through new messages for ToolMessage indicating success
+        for msg in new_agent_messages:
+            if hasattr(msg, "tool_calls") and msg.tool_calls:
+                 for call in msg.tool_calls:
+                     arguments = ", ".join(f"{key}={value!r}" for key, value in call["args"].items())
+                     episode["trajectory"] += f"Agent Tool Call: {call['name']}({arguments})\n"
+            elif msg.type == "tool":
+                episode["trajectory"] += f"Tool Output: {msg.content}\n"
+                if "Booked" in str(msg.content) or "Found" in str(msg.content):
+                    episode["success"] = True
+            elif msg.type == "ai":
+                episode["trajectory"] += f"Agent: {msg.content}\n"
+                if msg.content:
+                     episode["history"].append(msg)
+
+        return episode["success"]
+
+    def _last_agent_response(self, episode: Dict[str, Any]) -> str:
+        # Get the final response text to send to user
+        for msg in reversed(episode["messages"]):
+            if isinstance(msg, AIMessage) and msg.content:
+                return msg.content
+        return ""
+
+    def _observe_user_turn(self, episode: Dict[str, Any], user_response: str) -> HumanMessage:
+        episode["trajectory"] += f"User: {user_response}\n"
+        
+        user_msg = HumanMessage(content=user_response)
+        episode["history"].append(user_msg)
+        episode["messages"] = episode["messages"] + [user_msg]
+        return user_msg
 
+    def _to_memory_episode(self, episode: Dict[str, Any]) -> Episode:
+        return Episode(
+            task_description=episode["task"],
+            trajectory=episode["trajectory"],
+            success=episode["success"],
+            turns=episode["turns"],
+            metadata={"goal": episode["goal"]}
+        )
@@ -0,0 +1,191 @@
+import abc
+import itertools
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Rows read (and, in eval, prefetched) per chunk
+DEFAULT_CHUNK_SIZE = 1024
+
+_GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+_UINT64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _pyarrow_parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise ImportError("Parquet datasets need pyarrow: install it with `pip install pyarrow`") from error
+    return pq
+
+
+def sample_mask(rows: np.ndarray, fraction: float, seed: int) -> np.ndarray:
+    """
+    Deterministic Bernoulli sample over row numbers: row r is kept iff a
+    splitmix64 hash of (seed, r) falls below `fraction`. The decision depends
+    only on the row number, so it is the same for any chunking of the file.
+    """
+    z = rows.astype(np.uint64) * np.uint64(_GOLDEN_GAMMA) + np.uint64((seed * _GOLDEN_GAMMA + 1) & _UINT64)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53) < fraction
+
+
+class TaskDataset(abc.ABC):
+    """
+    Benchmark tasks ({"goal", "task"} dicts) read lazily in chunks.
+
+    Episode `i` runs row `i % len(dataset)`. With `sample` only a
+    deterministic fraction of the rows is kept (see `sample_mask`); with
+    `shard=(k, n)` only every n-th kept row starting at the k-th, so n
+    workers see disjoint parts of the same sample. Subclasses read the raw
+    rows; only one chunk is held at a time.
+    """
+
+    # Whole dataset held in memory (random access, cheap to re-read)
+    in_memory = False
+
+    def __init__(self, sample: Optional[float] = None, seed: int = 0, shard: Optional[Tuple[int, int]] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        if sample is not None and not 0 < sample <= 1:
+            raise ValueError(f"Dataset sample must be a fraction in (0, 1], got {sample}")
+        if shard is not None and not 0 <= shard[0] < shard[1]:
+            raise ValueError(f"Dataset shard must be (index, count) with 0 <= index < count, got {shard}")
+        self.sample = sample
+        self.seed = seed
+        self.shard = shard
+        self.chunk_size = chunk_size
+        self._len: Optional[int] = None
+
+    @abc.abstractmethod
+    def _raw_len(self) -> int:
+        """Row count of the file, before sampling and sharding."""
+
+    @abc.abstractmethod
+    def _raw_chunks(self) -> Iterator[List[Dict[str, Any]]]:
+        """All rows in file order, `chunk_size` at a time."""
+
+    def _keep(self, start: int, count: int, sampled_before: int) -> Tuple[np.ndarray, int]:
+        """
+        Which of the raw rows start..start+count survive sampling and sharding,
+        and how many survive sampling alone (shard positions count those).
+        """
+        keep = sample_mask(np.arange(start, start + count), self.sample, self.seed) if self.sample is not None else np.ones(count, dtype=bool)
+        sampled = int(keep.sum())
+        if self.shard is not None:
+            positions = sampled_before + np.cumsum(keep) - 1
+            keep &= positions % self.shard[1] == self.shard[0]
+        return keep, sampled
+
+    def chunks(self) -> Iterator[List[Dict[str, Any]]]:
+        """The rows of this dataset (after sampling and sharding), chunk by chunk."""
+        start = sampled_before = 0
+        for chunk in self._raw_chunks():
+            keep, sampled = self._keep(start, len(chunk), sampled_before)
+            start += len(chunk)
+            sampled_before += sampled
+            rows = [row for row, kept in zip(chunk, keep) if kept]
+            if rows:
+                yield rows
+
+    def __len__(self) -> int:
+        """Row count; with sampling or sharding it is computed from row numbers alone, without reading rows."""
+        if self._len is None:
+            raw = self._raw_len()
+            if self.sample is None and self.shard is None:
+                self._len = raw
+            else:
+                total = sampled_before = 0
+                for start in range(0, raw, self.chunk_size):
+                    keep, sampled = self._keep(start, min(self.chunk_size, raw - start), sampled_before)
+                    total += int(keep.sum())
+                    sampled_before += sampled
+                self._len = total
+        return self._len
+
+    def rows(self, indices: Iterable[int]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        (episode index, task) for each index, streaming through the file.
+        Ascending indices take one pass per wrap-around of the dataset.
+        """
+        stream, position = None, 0
+        for index in indices:
+            if len(self) == 0:
+                raise ValueError("The benchmark dataset has no tasks")
+            row = index % len(self)
+            if stream is None or row < position:
+                stream, position = itertools.chain.from_iterable(self.chunks()), 0
+            for item in stream:
+                position += 1
+                if position - 1 == row:
+                    yield index, item
+                    break
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        return next(self.rows([index]))[1]
+
+
+class ListDataset(TaskDataset):
+    """Tasks already in memory (the built-in sets, CSV and JSON files)."""
+
+    in_memory = True
+
+    def __init__(self, items: List[Dict[str, Any]], **kwargs: Any):
+        super().__init__(**kwargs)
+        self.items = items
+        self._selected = items if self.sample is None and self.shard is None else [row for chunk in self.chunks() for row in chunk]
+
+    def _raw_len(self) -> int:
+        return len(self.items)
+
+    def _raw_chunks(self) -> Iterator[List[Dict[str, Any]]]:
+        for start in range(0, len(self.items), self.chunk_size):
+            yield self.items[start:start + self.chunk_size]
+
+    def __len__(self) -> int:
+        return len(self._selected)
+
+    def rows(self, indices: Iterable[int]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for index in indices:
+            if not self._selected:
+                raise ValueError("The benchmark dataset has no tasks")
+            yield index, self._selected[index % len(self._selected)]
+
+
+class JsonlDataset(TaskDataset):
+    """One JSON task per line; blank lines are ignored."""
+
+    def __init__(self, path: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def _raw_len(self) -> int:
+        with open(self.path, "rb") as f:
+            return sum(1 for line in f if line.strip())
+
+    def _raw_chunks(self) -> Iterator[List[Dict[str, Any]]]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = (line for line in f if line.strip())
+            while True:
+                chunk = [json.loads(line) for line in itertools.islice(lines, self.chunk_size)]
+                if not chunk:
+                    return
+                yield chunk
+
+
+class ParquetDataset(TaskDataset):
+    """A Parquet file with `goal` and `task` columns, read in record batches (needs pyarrow)."""
+
+    def __init__(self, path: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.path = path
+        self._file = _pyarrow_parquet().ParquetFile(path)
+
+    def _raw_len(self) -> int:
+        return self._file.metadata.num_rows
+
+    def _raw_chunks(self) -> Iterator[List[Dict[str, Any]]]:
+        for batch in self._file.iter_batches(batch_size=self.chunk_size, columns=["goal", "task"]):
+            yield batch.to_pylist()
@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+# Fields kept in memory per logged episode; trajectories stay on disk
+SUMMARY_FIELDS = ("success", "turns", "trace")
+
+
+class ResultsLog:
+    """
+    Append-only JSONL log of finished benchmark episodes, one object per line.
+
+    Every record is flushed and fsynced as soon as it is written, so a crash
+    loses at most the episode in flight. With `resume=True` the existing log
+    is kept: completed episodes are indexed by their `index` field (the last
+    record of an index wins) and a torn final line is cut off. Otherwise an
+    existing log is truncated.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.completed: Dict[int, Tuple[int, Dict[str, Any]]] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        if resume and os.path.exists(path):
+            self._index()
+        elif os.path.exists(path):
+            print(f"Overwriting results log {path} (pass --resume to continue it)")
+            open(path, "w").close()
+
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def _index(self):
+        """Maps each logged episode index to (byte offset, summary)."""
+        valid_end = 0
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn write from a crash; everything after it is discarded
+                if not line.endswith(b"\n"):
+                    break
+                self.completed[record["index"]] = (offset, {field: record.get(field) for field in SUMMARY_FIELDS})
+                offset += len(line)
+                valid_end = offset
+
+        if valid_end < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_end)
+
+    def append(self, record: Dict[str, Any]):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def read(self, offset: int) -> Dict[str, Any]:
+        """The full record written at `offset`."""
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from memory.memory import FreeBaoMemory
+
+
+def shard_indices(num_episodes: int, num_shards: int, shard: int) -> List[int]:
+    """Episode indices of one shard; striding keeps every task spread across shards."""
+    return list(range(shard, num_episodes, num_shards))
+
+
+def shard_directory(shard_root: str, shard: int) -> str:
+    return os.path.join(shard_root, f"shard-{shard}")
+
+
+def _warmup_shard(task: Tuple[int, int, int, Dict[str, Any], Dict[str, Any], Optional[Tuple[str, str]], int]) -> str:
+    """Worker entry point: runs one shard's warmup episodes into its own memory store."""
+    shard, num_shards, num_episodes, memory_kwargs, runner_kwargs, llm_cache_args, concurrency = task
+    from simulation.benchmark import BenchmarkRunner
+
+    llm_cache = None
+    if llm_cache_args is not None:
+        from agent.llm_cache import ResponseCache
+        llm_cache = ResponseCache(*llm_cache_args)
+
+    memory = FreeBaoMemory(**memory_kwargs)
+    with memory:
+        runner = BenchmarkRunner(memory, llm_cache=llm_cache, **runner_kwargs)
+        runner.run_benchmark(num_episodes=num_episodes, mode="warmup", concurrency=concurrency,
+                             episode_indices=shard_indices(num_episodes, num_shards, shard))
+    return memory_kwargs["persist_directory"]
+
+
+def run_sharded_warmup(memory: FreeBaoMemory, num_episodes: int, num_shards: int, shard_root: str,
+                       memory_kwargs: Dict[str, Any], runner_kwargs: Dict[str, Any],
+                       llm_cache_args: Optional[Tuple[str, str]] = None, concurrency: int = 1) -> Dict[str, int]:
+    """
+    Splits the warmup episodes across `num_shards` worker processes, each
+    writing to its own FreeBaoMemory in a fresh per-run directory under
+    `shard_root`, then merges the shards into `memory` (see
+    `FreeBaoMemory.merge_from`). The run's shard stores are removed
+    afterwards, so nothing carries over to the next run.
+
+    `memory_kwargs` and `runner_kwargs` rebuild the memory and the
+    BenchmarkRunner inside each worker; `llm_cache_args` is the
+    (path, mode) of a shared ResponseCache. Workers are spawned rather than
+    forked so no threads or open stores are inherited.
+    """
+    os.makedirs(shard_root, exist_ok=True)
+    run_root = tempfile.mkdtemp(prefix="warmup-", dir=shard_root)
+    tasks = []
+    for shard in range(num_shards):
+        shard_memory_kwargs = dict(memory_kwargs, persist_directory=shard_directory(run_root, shard), max_episodes=None)
+        shard_runner_kwargs = dict(runner_kwargs)
+        if shard_runner_kwargs.get("results_dir"):
+            shard_runner_kwargs["results_dir"] = shard_directory(shard_runner_kwargs["results_dir"], shard)
+        tasks.append((shard, num_shards, num_episodes, shard_memory_kwargs, shard_runner_kwargs, llm_cache_args, concurrency))
+
+    print(f"--- Starting SHARDED WARMUP ({num_episodes} episodes over {num_shards} processes) ---")
+    shards = []
+    try:
+        with ProcessPoolExecutor(max_workers=num_shards, mp_context=multiprocessing.get_context("spawn")) as pool:
+            directories = list(pool.map(_warmup_shard, tasks))
+
+        shards = [FreeBaoMemory(**dict(memory_kwargs, persist_directory=directory, max_episodes=None)) for directory in directories]
+        stats = memory.merge_from(shards)
+    finally:
+        for shard in shards:
+            shard.close()
+        shutil.rmtree(run_root, ignore_errors=True)
+    print(f"Merged {len(shards)} shards: {stats}")
+    return stats
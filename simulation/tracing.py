@@ -0,0 +1,137 @@
+import contextlib
+import cProfile
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+
+class EpisodeTrace(BaseCallbackHandler):
+    """
+    Collects timings and token counts for one episode.
+
+    Passed as a callback to the agent graph and the user simulator, it
+    records wall time per graph node (`retrieve`, `reason`, `tools`), prompt
+    and completion tokens per LLM call (labelled by graph node, or by run
+    name outside the graph), the retrieval candidate count reported by the
+    `retrieve` node and the history tokens the `reason` node did not resend.
+    `timed` and `count_tokens` cover calls made outside any callback.
+    """
+
+    # Handlers run in the calling thread, also under ainvoke
+    run_inline = True
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.tokens: Dict[str, int] = defaultdict(int)
+        self.retrieval_candidates = 0
+        self._nodes: Dict[UUID, tuple] = {}
+        self._llm_labels: Dict[UUID, str] = {}
+
+    def record(self, name: str, seconds: float):
+        self.seconds[name] += seconds
+        self.calls[name] += 1
+
+    def count_tokens(self, name: str, tokens: int):
+        self.tokens[name] += tokens
+
+    @contextlib.contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    # --- Graph nodes ---
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None, **kwargs: Any):
+        # Only the node's outermost run counts; runnables nested inside it share
+        # its metadata and may share its name too
+        node = (metadata or {}).get("langgraph_node")
+        if node is None or kwargs.get("name") != node:
+            return
+        if parent_run_id in self._nodes and self._nodes[parent_run_id][0] == node:
+            return
+        self._nodes[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any):
+        started = self._nodes.pop(run_id, None)
+        if started is None:
+            return
+        node, start = started
+        self.record(node, time.perf_counter() - start)
+        if isinstance(outputs, dict) and isinstance(outputs.get("retrieval_candidates"), int):
+            self.retrieval_candidates += outputs["retrieval_candidates"]
+        if isinstance(outputs, dict) and isinstance(outputs.get("history_tokens_saved"), int):
+            self.count_tokens(f"{node}_history_tokens_saved", outputs["history_tokens_saved"])
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        started = self._nodes.pop(run_id, None)
+        if started is not None:
+            self.record(started[0], time.perf_counter() - started[1])
+
+    # --- LLM calls ---
+    def on_chat_model_start(self, serialized: Optional[Dict[str, Any]], messages: List[List[Any]], *, run_id: UUID,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any):
+        self._llm_labels[run_id] = (metadata or {}).get("langgraph_node") or kwargs.get("name") or "llm"
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        label = self._llm_labels.pop(run_id, "llm")
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                self.tokens[f"{label}_prompt_tokens"] += usage.get("input_tokens", 0)
+                self.tokens[f"{label}_completion_tokens"] += usage.get("output_tokens", 0)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._llm_labels.pop(run_id, None)
+
+    def summary(self) -> Dict[str, float]:
+        """Flat metrics for this episode: `<name>_ms`, `<name>_calls`, token counts, candidates."""
+        metrics: Dict[str, float] = {}
+        for name, seconds in self.seconds.items():
+            metrics[f"{name}_ms"] = seconds * 1000
+            metrics[f"{name}_calls"] = self.calls[name]
+        metrics.update(self.tokens)
+        metrics["retrieval_candidates"] = self.retrieval_candidates
+        return metrics
+
+
+def aggregate_traces(summaries: List[Dict[str, float]]) -> Dict[str, float]:
+    """Per-phase totals and per-episode means of episode trace summaries."""
+    if not summaries:
+        return {}
+    totals: Dict[str, float] = defaultdict(float)
+    for summary in summaries:
+        for name, value in summary.items():
+            totals[name] += value
+
+    metrics = {}
+    for name, total in sorted(totals.items()):
+        metrics[f"trace_{name}_total"] = total
+        metrics[f"trace_{name}_per_episode"] = total / len(summaries)
+    return metrics
+
+
+@contextlib.contextmanager
+def profiled(path: Optional[str]) -> Iterator[None]:
+    """Runs the block under cProfile and dumps stats to `path`; a no-op when `path` is None."""
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        profiler.dump_stats(path)
+        print(f"Profile written to {path} (inspect with `python -m pstats {path}`)")
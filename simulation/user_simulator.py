@@ -1,11 +1,19 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import Callbacks
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
-from langchain_openai import ChatOpenAI
 import os
+from agent.history import HistoryPolicy, HistoryState
+from utils import lazy_import
+
+langchain_openai = lazy_import("langchain_openai")
 
 class UserSimulator:
-    def __init__(self, model_name: str = "gpt-4o"):
-        self.llm = ChatOpenAI(model=model_name, temperature=0.7)
+    def __init__(self, model_name: str = "gpt-4o", cache: Optional[BaseCache] = None, llm: Optional[BaseChatModel] = None,
+                 history_policy: Optional[HistoryPolicy] = None):
+        self.history_policy = history_policy or HistoryPolicy()
+        self.llm = llm if llm is not None else langchain_openai.ChatOpenAI(model=model_name, temperature=0.7, cache=cache)
         self.system_prompt = """You are a user interacting with an AI assistant.
 You have a specific GOAL that you want the assistant to help you with.
 The assistant does not know your goal initially.
@@ -15,13 +23,33 @@ Be impatient if the assistant asks redundant or irrelevant questions.
 Your goal is: {goal}
 """
 
-    def step(self, agent_last_message: str, goal: str, history: List[BaseMessage]) -> str:
-        """Generates the user's response."""
-        messages = [
-            SystemMessage(content=self.system_prompt.format(goal=goal)),
+    def _messages(self, agent_last_message: str, goal: str, history: List[BaseMessage],
+                  history_state: Optional[HistoryState]) -> List[BaseMessage]:
+        # Without a state to carry the summary between turns the full history is sent
+        summary = ""
+        if history_state is not None:
+            history = self.history_policy.apply(history, history_state)
+            summary = HistoryPolicy.summary_block(history_state)
+        return [
+            SystemMessage(content=self.system_prompt.format(goal=goal) + summary),
             *history,
             AIMessage(content=agent_last_message)
         ]
-        
-        response = self.llm.invoke(messages)
+
+    def _config(self, callbacks: Callbacks) -> Dict[str, Any]:
+        return {"callbacks": callbacks, "run_name": "user_simulator"}
+
+    def step(self, agent_last_message: str, goal: str, history: List[BaseMessage], callbacks: Callbacks = None,
+             history_state: Optional[HistoryState] = None) -> str:
+        """
+        Generates the user's response. Pass one `history_state` per
+        conversation to bound the history with the simulator's history policy.
+        """
+        response = self.llm.invoke(self._messages(agent_last_message, goal, history, history_state), config=self._config(callbacks))
+        return response.content
+
+    async def astep(self, agent_last_message: str, goal: str, history: List[BaseMessage], callbacks: Callbacks = None,
+                    history_state: Optional[HistoryState] = None) -> str:
+        """Async variant of `step` for concurrent episodes."""
+        response = await self.llm.ainvoke(self._messages(agent_last_message, goal, history, history_state), config=self._config(callbacks))
         return response.content
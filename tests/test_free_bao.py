@@ -1,15 +1,22 @@
+import json
+import numpy as np
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from memory.memory import FreeBaoMemory, Episode
+from memory.embedding_cache import EmbeddingCache
+from memory.numpy_store import NumpyCollection
+from memory.pareto import LeaderClusters, cluster_by_similarity, pareto_front_ranks, select_pareto
+from memory.compaction import compact_trajectory
 from agent.react_agent import FreeBaoAgent
 from simulation.user_simulator import UserSimulator
+from simulation.benchmark import BenchmarkRunner
 from langchain_core.messages import AIMessage, HumanMessage
 
 @pytest.fixture
 def mock_memory():
     # Mocking ChromaDB client would be complex, so we mock MOCER methods directly if possible.
     # But MOCER uses persistent client. Let's start with a fresh persistent dir for tests or mock it.
-    with patch("memory.memory.chromadb.Client") as mock_client:
+    with patch("memory.memory.chromadb.Client") as mock_client, patch("memory.embedders.sentence_transformers.SentenceTransformer"):
         mock_collection = MagicMock()
         mock_client.return_value.get_or_create_collection.return_value = mock_collection
         
@@ -22,6 +29,22 @@ def mock_memory():
         
         return memory
 
+@pytest.fixture
+def scripted_memory(tmp_path):
+    # A real numpy-backed store with the offline hash encoder; no model download
+    from benchmarks.fakes import HashEncoder
+    return FreeBaoMemory(persist_directory=str(tmp_path / "db"), backend="numpy", model=HashEncoder())
+
+@pytest.fixture
+def scripted_runner(scripted_memory, tmp_path):
+    # Builds BenchmarkRunners over `scripted_memory` driven by the scripted agent and user models
+    from benchmarks.fakes import ScriptedAgentModel, ScriptedUserModel
+
+    def build(**kwargs):
+        kwargs.setdefault("results_dir", str(tmp_path / "results"))
+        return BenchmarkRunner(scripted_memory, agent_llm=ScriptedAgentModel(), user_llm=ScriptedUserModel(), **kwargs)
+    return build
+
 def test_mo_cer_add_episode(mock_memory):
     episode = Episode(
         task_description="Test Task",
@@ -31,7 +54,7 @@ def test_mo_cer_add_episode(mock_memory):
         metadata={}
     )
     mock_memory.add_episode(episode)
-    mock_memory.collection.add.assert_called_once()
+    mock_memory.collection.upsert.assert_called_once()
 
 def test_mo_cer_retrieve_pareto(mock_memory):
     # Mock query results
@@ -51,16 +74,805 @@ def test_mo_cer_retrieve_pareto(mock_memory):
     assert results[0]["turns"] == 2 # Should be first
     assert results[1]["turns"] == 5
 
-@patch("agent.react_agent.ChatOpenAI")
+def test_prefetch_serves_retrievals_from_one_batched_query(mock_memory):
+    mock_memory.model.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 384))
+    mock_memory.collection.query.return_value = {
+        "ids": [["1"], ["2"]],
+        "documents": [["traj1"], ["traj2"]],
+        "metadatas": [[{"turns": 3, "task": "t1"}], [{"turns": 1, "task": "t2"}]],
+        "distances": [[0.1], [0.2]]
+    }
+
+    mock_memory.prefetch(["t1", "t2", "t1"], k=1)
+    for _ in range(5):
+        assert mock_memory.retrieve_pareto_efficient("t1", k=1)[0]["trajectory"] == "traj1"
+        assert mock_memory.retrieve_pareto_efficient("t2", k=1)[0]["trajectory"] == "traj2"
+
+    mock_memory.collection.query.assert_called_once()
+    assert len(mock_memory.collection.query.call_args.kwargs["query_embeddings"]) == 2
+
+def test_embedding_cache_reuses_task_embeddings(mock_memory):
+    mock_memory.collection.query.return_value = {
+        "ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]
+    }
+
+    for _ in range(3):
+        mock_memory.retrieve_pareto_efficient("Book a flight.")
+    mock_memory.retrieve_pareto_efficient("  Book a   flight. ")
+
+    assert mock_memory.model.encode.call_count == 1
+    assert mock_memory.cache_stats()["hits"] == 3
+    assert mock_memory.cache_stats()["misses"] == 1
+
+def test_swapping_the_model_rekeys_the_embedding_cache(tmp_path):
+    from benchmarks.fakes import HashEncoder
+
+    memory = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy", model=HashEncoder(dim=8),
+                           persist_embeddings=True)
+    assert len(memory.encode("Book a flight.")) == 8
+
+    memory.model = HashEncoder(dim=16)
+    assert memory.embedder_name == "fake-hash/16"
+    assert memory.embedding_cache.model_name == "fake-hash/16"
+    # Not served the vector cached for the previous model, from either tier
+    assert len(memory.encode("Book a flight.")) == 16
+    memory.close()
+
+def test_embedding_cache_persists_to_disk(tmp_path):
+    path = str(tmp_path / "embedding_cache.sqlite3")
+    cache = EmbeddingCache("test-model", max_size=1, path=path)
+    cache.put("task a", np.array([1.0, 2.0]))
+    cache.put("task b", np.array([3.0, 4.0]))  # evicts "task a" from the LRU tier
+    assert cache.get("task a").tolist() == [1.0, 2.0]
+    cache.close()
+
+    warm = EmbeddingCache("test-model", path=path)
+    assert warm.get("task b").tolist() == [3.0, 4.0]
+    assert EmbeddingCache("other-model", path=path).get("task b") is None
+
+def test_add_episodes_batches_encode_and_write(mock_memory):
+    mock_memory.model.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 384))
+    episodes = [
+        Episode(task_description=f"Task {i % 2}", trajectory=f"traj {i}", success=True, turns=i + 1)
+        for i in range(4)
+    ]
+
+    mock_memory.add_episodes(episodes)
+
+    mock_memory.model.encode.assert_called_once()
+    assert mock_memory.model.encode.call_args[0][0] == ["Task 0", "Task 1"]
+    mock_memory.collection.upsert.assert_called_once()
+    assert len(mock_memory.collection.upsert.call_args.kwargs["ids"]) == 4
+
+def test_write_buffer_flushes_by_size_and_on_close(mock_memory):
+    mock_memory.write_buffer_size = 2
+    episode = Episode(task_description="Task", trajectory="traj", success=True, turns=1)
+
+    mock_memory.add_episode(episode)
+    mock_memory.collection.upsert.assert_not_called()
+    mock_memory.add_episode(episode)
+    assert mock_memory.collection.upsert.call_count == 1
+
+    mock_memory.add_episode(episode)
+    mock_memory.close()
+    assert mock_memory.collection.upsert.call_count == 2
+
+def test_numpy_collection_matches_brute_force_and_persists(tmp_path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(50, 8)).astype(np.float32)
+    metadatas = [{"success": i % 3 != 0, "turns": i % 5 + 1, "task": f"t{i}"} for i in range(50)]
+    store = NumpyCollection(str(tmp_path / "store"))
+    store.add(ids=[str(i) for i in range(25)], embeddings=embeddings[:25].tolist(),
+              documents=[f"d{i}" for i in range(25)], metadatas=metadatas[:25])
+    store.add(ids=[str(i) for i in range(25, 50)], embeddings=embeddings[25:].tolist(),
+              documents=[f"d{i}" for i in range(25, 50)], metadatas=metadatas[25:])
+
+    reopened = NumpyCollection(str(tmp_path / "store"))
+    query = rng.normal(size=(2, 8)).astype(np.float32)
+    results = reopened.query(query_embeddings=query.tolist(), n_results=4, where={"success": True})
+
+    successful = np.array([m["success"] for m in metadatas])
+    for row, q in enumerate(query):
+        distances = ((embeddings - q) ** 2).sum(axis=1)
+        distances[~successful] = np.inf
+        expected = np.argsort(distances)[:4]
+        assert results["ids"][row] == [str(i) for i in expected]
+        np.testing.assert_allclose(results["distances"][row], distances[expected], rtol=1e-4)
+
+def test_numpy_backend_serves_memory_api(tmp_path):
+    with patch("memory.embedders.sentence_transformers.SentenceTransformer") as mock_model:
+        mock_model.return_value.encode.side_effect = lambda texts, **kwargs: np.array(
+            [[len(text), 1.0] for text in texts], dtype=np.float32
+        )
+        memory = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy")
+        memory.add_episodes([
+            Episode(task_description="Book a flight.", trajectory="slow", success=True, turns=6),
+            Episode(task_description="Book a flight.", trajectory="fast", success=True, turns=2),
+            Episode(task_description="Book a flight.", trajectory="failed", success=False, turns=1),
+        ])
+
+        assert memory.collection.count() == 3
+        assert "fast" in memory.get_formatted_retrieval("Book a flight.", k=1)
+        assert [item["trajectory"] for item in memory.retrieve_pareto_efficient("Book a flight.", k=5)] == ["fast", "slow"]
+
+def test_pareto_front_ranks_match_brute_force():
+    rng = np.random.default_rng(0)
+    distances = rng.integers(0, 10, size=200).astype(float) / 10  # plenty of ties and duplicates
+    turns = rng.integers(1, 15, size=200).astype(float)
+
+    expected = np.full(200, -1)
+    remaining = set(range(200))
+    front = 0
+    while remaining:
+        current = {
+            i for i in remaining
+            if not any(distances[j] <= distances[i] and turns[j] <= turns[i]
+                       and (distances[j] < distances[i] or turns[j] < turns[i]) for j in remaining)
+        }
+        expected[list(current)] = front
+        remaining -= current
+        front += 1
+
+    np.testing.assert_array_equal(pareto_front_ranks(distances, turns), expected)
+
+def test_select_pareto_fills_k_from_successive_fronts():
+    distances = np.array([0.1, 0.2, 0.3, 0.15, 0.9])
+    turns = np.array([9.0, 4.0, 1.0, 9.5, 1.0])
+    # Front 0: 0, 1, 2. Front 1: 3, 4.
+    assert select_pareto(distances, turns, k=2, alpha=0.1).tolist() == [2, 1]
+    assert select_pareto(distances, turns, k=4, alpha=0.1).tolist() == [2, 1, 0, 4]
+
+def test_pareto_retrieval_fetches_documents_for_selected_only(tmp_path):
+    with patch("memory.embedders.sentence_transformers.SentenceTransformer") as mock_model:
+        mock_model.return_value.encode.side_effect = lambda texts, **kwargs: np.zeros((len(texts), 2), dtype=np.float32)
+        memory = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy", retrieval_mode="pareto", alpha=0.0)
+        memory.add_episodes([
+            Episode(task_description="Book a flight.", trajectory=f"traj {turns}", success=True, turns=turns)
+            for turns in range(1, 8)
+        ])
+
+        with patch.object(memory.collection, "get", wraps=memory.collection.get) as get:
+            items = memory.retrieve_pareto_efficient("Book a flight.", k=2)
+
+        # Equal distances, so the fewest-turn episodes dominate
+        assert [item["trajectory"] for item in items] == ["traj 1", "traj 2"]
+        assert get.call_args.kwargs["ids"] == [memory.collection.ids[0], memory.collection.ids[1]]
+
+def test_readding_episodes_is_idempotent_and_capacity_evicts_dominated(tmp_path):
+    with patch("memory.embedders.sentence_transformers.SentenceTransformer") as mock_model:
+        # Two task clusters: flights and hotels
+        mock_model.return_value.encode.side_effect = lambda texts, **kwargs: np.array(
+            [[1.0, 0.0] if "flight" in text else [0.0, 1.0] for text in texts], dtype=np.float32
+        )
+        memory = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy", max_episodes=3)
+        flights = [Episode(task_description="Book a flight.", trajectory=f"flight {t}", success=True, turns=t) for t in (5, 2, 7)]
+        hotels = [Episode(task_description="Find a hotel.", trajectory=f"hotel {t}", success=True, turns=t) for t in (4, 6)]
+
+        memory.add_episodes(flights)
+        memory.add_episodes(flights)
+        assert memory.collection.count() == 3
+        assert memory.evictions == 0
+
+        memory.add_episodes(hotels)
+        kept = sorted(memory.collection.get()['documents'])
+        assert kept == ["flight 2", "flight 5", "hotel 4"]
+        assert memory.eviction_stats() == {"evictions": 2, "size": 3}
+
+        # Ids are content hashes, so they survive a restart and re-adds stay no-ops
+        reopened = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy", max_episodes=3)
+        reopened.add_episodes([flights[1]])
+        assert reopened.collection.count() == 3
+
+def test_capacity_evicts_to_low_water_and_clusters_incrementally(tmp_path):
+    from benchmarks.fakes import HashEncoder
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(5, 8)).astype(np.float32)
+    vectors = np.repeat(centers, 20, axis=0) + rng.normal(scale=0.01, size=(100, 8)).astype(np.float32)
+    clusters = LeaderClusters(0.15)
+    incremental = np.concatenate([clusters.assign(vectors[:40]), clusters.assign(vectors[40:])])
+    # Same partition as clustering everything at once
+    batch = cluster_by_similarity(vectors, 0.15)
+    assert len(set(zip(incremental, batch))) == len(set(batch)) == 5
+
+    memory = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy", model=HashEncoder(), max_episodes=20)
+    memory.add_episodes([Episode(task_description=f"Task {i}.", trajectory=f"traj {i}", success=True, turns=i) for i in range(21)])
+    assert memory.collection.count() == 18
+    get = MagicMock(wraps=memory.collection.get)
+    memory.collection.get = get
+    memory.add_episodes([Episode(task_description=f"Task {i}.", trajectory=f"traj {i}", success=True, turns=i) for i in range(21, 23)])
+    # Under capacity again, so no scan
+    assert get.call_count == 0
+    memory.add_episodes([Episode(task_description="Task 23.", trajectory="traj 23", success=True, turns=23)])
+    # Only the episodes stored since the last eviction are fetched with their embeddings
+    fetched = [call.kwargs["ids"] for call in get.call_args_list if "ids" in call.kwargs]
+    assert [len(ids) for ids in fetched] == [3]
+    assert memory.collection.count() == 18
+
+def test_numpy_collection_compacts_tombstones(tmp_path):
+    store = NumpyCollection(str(tmp_path / "store"))
+    ids = [str(i) for i in range(3000)]
+    store.add(ids=ids, embeddings=np.eye(3000, 4, dtype=np.float32), documents=ids,
+              metadatas=[{"success": True, "turns": 1} for _ in ids])
+    store.delete(ids=ids[:2500])
+
+    assert store.count() == 500
+    assert store._size == 500  # tombstones outnumbered live rows, so the store was rewritten
+    assert NumpyCollection(str(tmp_path / "store")).get(ids=["2999"])['documents'] == ["2999"]
+
+def test_numpy_collection_keeps_text_columns_on_disk(tmp_path):
+    from memory.numpy_store import _TextColumn
+
+    store = NumpyCollection(str(tmp_path / "store"))
+    store.add(ids=["a", "b"], embeddings=np.eye(2, 4, dtype=np.float32), documents=["first ✈", "second"],
+              metadatas=[{"task": "Book a flight.", "success": True, "turns": 3, "compact_trajectory": "c"},
+                         {"task": "Find a hotel.", "success": False, "turns": 5}])
+    store.upsert(ids=["a"], embeddings=np.eye(1, 4, dtype=np.float32), documents=["rewritten"],
+                 metadatas=[{"task": "Book a flight.", "success": True, "turns": 2}])
+
+    # Opening decodes only the ids; documents and metadata are read per returned row
+    decoded = []
+    original = _TextColumn.__getitem__
+    with patch.object(_TextColumn, "__getitem__", autospec=True,
+                      side_effect=lambda column, row: decoded.append(column.blob_path) or original(column, row)):
+        reopened = NumpyCollection(str(tmp_path / "store"))
+        assert decoded == []
+        result = reopened.query(query_embeddings=[[1.0, 0, 0, 0]], n_results=1, where={"task": "Book a flight."})
+    assert result["documents"] == [["rewritten"]]
+    assert result["metadatas"] == [[{"task": "Book a flight.", "success": True, "turns": 2}]]
+    assert reopened.get(ids=["b"])["metadatas"] == [{"task": "Find a hotel.", "success": False, "turns": 5}]
+
+    # The rewrite left stale bytes behind until the store is compacted
+    blob = tmp_path / "store" / "documents.utf8"
+    size = blob.stat().st_size
+    reopened.compact()
+    assert blob.stat().st_size < size
+    assert reopened.get()["documents"] == ["rewritten", "second"]
+
+def test_compact_trajectory_keeps_tool_calls_and_drops_chit_chat():
+    trajectory = (
+        "Agent: Hi! Where would you like to go? I can help with flights and hotels.\n"
+        "User: Paris, cheap please.\n"
+        "Agent Tool Call: book_flight(destination='Paris', price_limit=500)\n"
+        "Tool Output: Flight booked to Paris for $490. Confirmation: #12345.\n"
+        "Agent: All done, have a great trip!\n"
+    )
+    assert compact_trajectory(trajectory) == (
+        "Call: book_flight(destination='Paris', price_limit=500)\n"
+        "Result: Flight booked to Paris for $490."
+    )
+
+def test_formatted_retrieval_fills_token_budget_with_compact_examples(mock_memory):
+    chatter = "Agent: " + "Let me think about that for a moment. " * 20 + "\n"
+    trajectory = chatter + "Agent Tool Call: search_hotels(location='Tokyo', date='March 1st')\nTool Output: Found 3 hotels in Tokyo.\n"
+    mock_memory.collection.query.return_value = {
+        "ids": [["1", "2", "3"]],
+        "documents": [[trajectory] * 3],
+        "metadatas": [[{"turns": t, "task": "Find a hotel.", "compact_trajectory": compact_trajectory(trajectory)} for t in (1, 2, 3)]],
+        "distances": [[0.1, 0.1, 0.1]]
+    }
+
+    unbounded = mock_memory.get_formatted_retrieval("Find a hotel.", k=3)
+    budgeted = mock_memory.get_formatted_retrieval("Find a hotel.", k=3, token_budget=100)
+
+    assert unbounded.count("Example") == 3 and "Let me think" in unbounded
+    assert budgeted.count("Example") == 2 and "Let me think" not in budgeted
+    assert "search_hotels(location='Tokyo', date='March 1st')" in budgeted
+    assert mock_memory.get_formatted_retrieval("Find a hotel.", k=3, token_budget=5) == ""
+    stats = mock_memory.context_stats()
+    assert stats["retrievals"] == 3 and stats["sent_tokens"] < stats["raw_tokens"]
+
+@patch("agent.react_agent.langchain_openai.ChatOpenAI")
 def test_agent_graph_build(mock_chat, mock_memory):
     agent = FreeBaoAgent(mock_memory)
     app = agent.build_graph()
     assert app is not None
 
-@patch("simulation.user_simulator.ChatOpenAI")
+@patch("simulation.user_simulator.langchain_openai.ChatOpenAI")
 def test_user_simulator(mock_chat):
     sim = UserSimulator()
     mock_chat.return_value.invoke.return_value = AIMessage(content="I want a flight")
     
     response = sim.step("Hello", "Goal", [])
     assert response == "I want a flight"
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+@patch("simulation.benchmark.wandb")
+@patch("simulation.user_simulator.langchain_openai.ChatOpenAI")
+@patch("agent.react_agent.langchain_openai.ChatOpenAI")
+def test_benchmark_episodes_keep_order(mock_agent_chat, mock_user_chat, mock_wandb, mock_memory, concurrency):
+    mock_memory.model.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 384))
+    mock_memory.collection.query.return_value = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+    tool_call = AIMessage(content="", tool_calls=[
+        {"name": "search_hotels", "args": {"location": "Paris", "date": "today"}, "id": "call_1"}
+    ])
+
+    def respond(messages):
+        return AIMessage(content="Done.") if messages[-1].type == "tool" else tool_call
+
+    llm = mock_agent_chat.return_value.bind_tools.return_value
+    llm.invoke.side_effect = respond
+    llm.ainvoke = AsyncMock(side_effect=respond)
+
+    runner = BenchmarkRunner(mock_memory)
+    runner.run_benchmark(num_episodes=4, mode="warmup", concurrency=concurrency)
+
+    table = mock_wandb.Table.return_value
+    logged_tasks = [call.args[0] for call in table.add_data.call_args_list]
+    assert logged_tasks == [runner.dataset[i]["task"] for i in range(4)]
+    assert all(call.args[1] for call in table.add_data.call_args_list) # tool output "Found ..." is a success
+    assert mock_memory.collection.upsert.call_count == 4
+
+@patch("simulation.benchmark.wandb")
+@patch("simulation.user_simulator.langchain_openai.ChatOpenAI")
+@patch("agent.react_agent.langchain_openai.ChatOpenAI")
+def test_benchmark_reuses_graph_and_retrieves_once_per_episode(mock_agent_chat, mock_user_chat, mock_wandb, mock_memory):
+    mock_user_chat.return_value.invoke.return_value = AIMessage(content="Paris, tomorrow")
+    tool_call = AIMessage(content="", tool_calls=[
+        {"name": "search_hotels", "args": {"location": "Paris", "date": "tomorrow"}, "id": "call_1"}
+    ])
+
+    def respond(messages):
+        if messages[-1].type == "tool":
+            return AIMessage(content="Done.")
+        if messages[-1].content == "Paris, tomorrow":
+            return tool_call
+        return AIMessage(content="Where and when?")
+
+    llm = mock_agent_chat.return_value.bind_tools.return_value
+    llm.invoke.side_effect = respond
+
+    runner = BenchmarkRunner(mock_memory)
+    with patch.object(mock_memory, "get_formatted_retrieval", return_value="") as retrieval:
+        runner.run_benchmark(num_episodes=3, mode="warmup")
+
+    assert mock_agent_chat.call_count == 1
+    assert retrieval.call_count == 3
+    turns = [call.args[2] for call in mock_wandb.Table.return_value.add_data.call_args_list]
+    assert turns == [2, 2, 2]
+    # The checkpointed thread still gives the model the whole conversation
+    assert [m.type for m in llm.invoke.call_args_list[2].args[0]] == ["system", "human", "ai", "human", "ai", "tool"]
+
+def test_response_cache_records_then_replays_offline(tmp_path):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from agent.llm_cache import CacheMissError, ResponseCache
+
+    path = str(tmp_path / "llm_cache.sqlite3")
+    recorder = FakeListChatModel(responses=["I want a flight"], cache=ResponseCache(path, mode="record"))
+    assert recorder.invoke([HumanMessage(content="Hello")]).content == "I want a flight"
+
+    replay_cache = ResponseCache(path, mode="replay")
+    replayer = FakeListChatModel(responses=["I want a flight"], cache=replay_cache)
+    with patch.object(FakeListChatModel, "_call", side_effect=AssertionError("model was called")):
+        assert replayer.invoke([HumanMessage(content="Hello")]).content == "I want a flight"
+        with pytest.raises(CacheMissError):
+            replayer.invoke([HumanMessage(content="Something new")])
+    assert replay_cache.stats() == {"hits": 1, "misses": 1}
+
+def test_hot_path_benchmark_runs_offline_and_compares(scripted_memory, monkeypatch):
+    from benchmarks.bench_hot_paths import build_store, bench_retrieval, bench_runner, synthetic_tasks
+    from benchmarks.compare import compare
+
+    monkeypatch.setenv("WANDB_MODE", "disabled")
+    tasks = synthetic_tasks(20)
+    memory = scripted_memory
+    assert build_store(memory, 200, tasks) > 0
+    assert memory.collection.count() == 200
+
+    base = {"size": 200, **bench_retrieval(memory, tasks, queries=5, k=1, token_budget=64)}
+    base["episode_overhead_ms"] = bench_runner(memory, episodes=2, k=1)
+    base["add_episodes_per_s"] = 100.0
+
+    slower = dict(base, retrieve_p50_ms=base["retrieve_p50_ms"] * 2, add_episodes_per_s=50.0)
+    _, regressions = compare({"results": [base]}, {"results": [slower]}, threshold=0.1)
+    assert sorted(row["metric"] for row in regressions) == ["add_episodes_per_s", "retrieve_p50_ms"]
+
+@patch("simulation.benchmark.wandb")
+def test_episode_trace_records_nodes_tokens_and_candidates(mock_wandb, scripted_memory, scripted_runner, tmp_path):
+    from benchmarks.bench_hot_paths import build_store, synthetic_tasks
+
+    build_store(scripted_memory, 50, synthetic_tasks(10))
+    runner = scripted_runner(profile_dir=str(tmp_path / "prof"))
+    episode = runner._run_episode(0, "eval")
+
+    trace = episode["trace"].summary()
+    assert trace["retrieve_calls"] == 1 and trace["reason_calls"] == 3 and trace["tools_calls"] == 1
+    assert trace["user_simulator_calls"] == 1
+    assert trace["reason_prompt_tokens"] > 0 and trace["user_simulator_completion_tokens"] > 0
+    assert trace["retrieval_candidates"] == 3
+
+    runner.run_benchmark(num_episodes=2, mode="eval")
+    logged = {key for call in mock_wandb.log.call_args_list for key in call.args[0]}
+    assert {"trace_reason_ms_per_episode", "trace_retrieval_candidates_total", "avg_turns"} <= logged
+    assert (tmp_path / "prof" / "eval.prof").exists()
+
+def test_cli_imports_no_heavy_dependencies():
+    from benchmarks.bench_startup import measure_import
+
+    assert measure_import("main")["heavy"] == []
+    # The benchmark runs the agent graph, so only LangGraph may come with it
+    assert measure_import("simulation.benchmark")["heavy"] == ["langgraph"]
+
+def test_memory_defers_model_and_store_until_first_use(tmp_path):
+    with patch("memory.embedders.sentence_transformers.SentenceTransformer") as mock_model:
+        mock_model.return_value.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 2), dtype=np.float32)
+        memory = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy")
+        assert mock_model.call_count == 0 and memory._collection is None
+
+        memory.warm_up(background=True).join()
+        assert mock_model.call_count == 1 and memory.collection.count() == 0
+
+        memory.encode("Book a flight.")
+        assert mock_model.call_count == 1
+
+def test_hashing_embedder_ranks_similar_tasks_closer():
+    from memory.embedders import HashingEmbedder
+
+    embedder = HashingEmbedder(n_features=512)
+    vectors = embedder.encode(["Book a flight to Paris.", "Book a flight to Rome.", "Find a hotel in Tokyo."])
+    assert vectors.shape == (3, 512) and vectors.dtype == np.float32
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+    unprojected = embedder.name
+    embedder.fit([f"Book a flight to city {i}." for i in range(50)] + [f"Find a hotel in town {i}." for i in range(50)], n_components=8)
+    assert embedder.encode(["Book a flight."]).shape == (1, 8)
+    assert embedder.name != unprojected and "svd8" in embedder.name
+
+def test_memory_refuses_store_built_with_another_embedder(tmp_path):
+    from benchmarks.fakes import HashEncoder
+    from memory.embedders import HashingEmbedder
+
+    memory = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy", embedder=HashingEmbedder(n_features=64))
+    memory.add_episode(Episode(task_description="Book a flight.", trajectory="t", success=True, turns=2))
+    assert memory.collection.metadata == {"embedder": "hashing/char_wb-2-4-64"}
+
+    reopened = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy", embedder=HashingEmbedder(n_features=64))
+    assert reopened.collection.count() == 1
+
+    other = FreeBaoMemory(persist_directory=str(tmp_path), backend="numpy", model=HashEncoder(dim=64))
+    with pytest.raises(ValueError, match="built with embedder"):
+        other.retrieve_pareto_efficient("Book a flight.", k=1)
+
+@patch("simulation.benchmark.wandb")
+def test_benchmark_streams_results_and_resumes(mock_wandb, scripted_runner, tmp_path):
+    def runner(resume):
+        return scripted_runner(resume=resume, log_batch_size=2)
+
+    runner(resume=False).run_benchmark(num_episodes=2, mode="eval")
+    log_path = tmp_path / "results" / "free_bao_benchmark-eval.jsonl"
+    with open(log_path, "a") as f:
+        f.write('{"index": 2, "trunc')  # torn write from a crash
+
+    resumed = runner(resume=True)
+    with patch.object(resumed, "_run_episode", wraps=resumed._run_episode) as run_episode:
+        resumed.run_benchmark(num_episodes=4, mode="eval")
+
+    assert [call.args[0] for call in run_episode.call_args_list] == [2, 3]
+    records = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert [record["index"] for record in records] == [0, 1, 2, 3]
+    # Aggregates cover the logged and the new episodes
+    mock_wandb.log.assert_any_call({"avg_turns": 2.0, "success_rate": 1.0})
+    tasks = [call.args[0] for call in mock_wandb.Table.return_value.add_data.call_args_list[-4:]]
+    assert tasks == [resumed.dataset[i]["task"] for i in range(4)]
+
+@patch("simulation.benchmark.wandb")
+def test_results_uploader_logs_bounded_batches_under_distinct_keys(mock_wandb):
+    from simulation.benchmark import ResultsUploader
+
+    tables = []
+    mock_wandb.Table.side_effect = lambda **kwargs: tables.append(MagicMock()) or tables[-1]
+    uploader = ResultsUploader(["task"], batch_size=2, indices=[0, 1, 2, 3, 4], logged_row=lambda index: None)
+    for index in (1, 0, 2, 3, 4):
+        uploader.add(index, [f"task {index}"])
+    uploader.flush()
+
+    # One fresh table per batch, none kept after it is logged
+    assert [[call.args[0] for call in table.add_data.call_args_list] for table in tables] == [
+        ["task 0", "task 1"], ["task 2", "task 3"], ["task 4"]]
+    assert [logged.args[0] for logged in mock_wandb.log.call_args_list] == [
+        {f"results_table/{n}": table} for n, table in enumerate(tables)]
+    assert uploader._table is None
+
+def test_merge_keeps_fewest_turn_duplicate_and_reuses_embeddings(tmp_path):
+    from benchmarks.fakes import HashEncoder
+
+    def store(name):
+        return FreeBaoMemory(persist_directory=str(tmp_path / name), backend="numpy", model=HashEncoder(dim=8))
+
+    def flight(turns, user_line):
+        trajectory = f"User: {user_line}\nAgent Tool Call: book_flight(destination='Paris')\nTool Output: Booked."
+        return Episode(task_description="Book a flight.", trajectory=trajectory, success=True, turns=turns)
+
+    target, shard_a, shard_b = store("target"), store("a"), store("b")
+    target.add_episodes([flight(6, "slow")])
+    shard_a.add_episodes([flight(3, "quick"), Episode(task_description="Find a hotel.", trajectory="Tool Output: Found.", success=True, turns=2)])
+    shard_b.add_episodes([flight(4, "medium"), flight(3, "quick")])
+
+    with patch.object(target.embedder, "encode", side_effect=AssertionError("re-encoded")):
+        stats = target.merge_from([shard_a, shard_b])
+
+    assert stats == {"copied": 2, "replaced": 1, "duplicates": 3, "size": 2}
+    kept = {meta["task"]: meta["turns"] for meta in target.collection.get()["metadatas"]}
+    assert kept == {"Book a flight.": 3, "Find a hotel.": 2}
+
+def test_sharded_warmup_runs_in_processes_merges_and_cleans_up(tmp_path, monkeypatch):
+    from benchmarks.fakes import HashEncoder, ScriptedAgentModel, ScriptedUserModel
+    from simulation.sharding import run_sharded_warmup
+
+    monkeypatch.setenv("WANDB_MODE", "disabled")
+    memory_kwargs = dict(persist_directory=str(tmp_path / "db"), backend="numpy", model=HashEncoder(dim=16))
+    memory = FreeBaoMemory(**memory_kwargs)
+    runner_kwargs = dict(agent_llm=ScriptedAgentModel(), user_llm=ScriptedUserModel(), results_dir=str(tmp_path / "results"))
+
+    stats = run_sharded_warmup(memory, num_episodes=6, num_shards=2, shard_root=str(tmp_path / "shards"),
+                               memory_kwargs=memory_kwargs, runner_kwargs=runner_kwargs)
+
+    # The scripted agent solves every task the same way, so each distinct task survives once
+    from simulation.benchmark import TASKS
+    assert stats["size"] == memory.collection.count() == len({item["task"] for item in TASKS})
+    assert (tmp_path / "results" / "shard-1" / "free_bao_benchmark-warmup.jsonl").read_text().count("\n") == 3
+    assert list((tmp_path / "shards").iterdir()) == []
+
+    # A second run starts from empty shards, even with another embedder
+    from memory.embedders import HashingEmbedder
+    memory_kwargs = dict(persist_directory=str(tmp_path / "db2"), backend="numpy", embedder=HashingEmbedder(n_features=64))
+    memory = FreeBaoMemory(**memory_kwargs)
+    stats = run_sharded_warmup(memory, num_episodes=2, num_shards=2, shard_root=str(tmp_path / "shards"),
+                               memory_kwargs=memory_kwargs, runner_kwargs=runner_kwargs)
+    assert stats["size"] == memory.collection.count() == 2
+
+def test_snapshot_round_trip_reuses_embeddings(tmp_path):
+    from benchmarks.fakes import HashEncoder
+
+    source = FreeBaoMemory(persist_directory=str(tmp_path / "source"), backend="numpy", alpha=0.3, model=HashEncoder(dim=8))
+    source.add_episodes([
+        Episode(task_description="Book a flight.", trajectory="Tool Output: Booked. ✈", success=True, turns=3),
+        Episode(task_description="Find a hotel.", trajectory="Tool Output: Found.", success=False, turns=5),
+    ])
+    assert source.export_snapshot(str(tmp_path / "snapshot")) == 2
+    manifest = json.loads((tmp_path / "snapshot" / "manifest.json").read_text())
+    assert manifest["embedder"] == source.embedder_name and manifest["alpha"] == 0.3
+
+    target = FreeBaoMemory(persist_directory=str(tmp_path / "target"), backend="numpy", model=HashEncoder(dim=8))
+    with patch.object(target.embedder, "encode", side_effect=AssertionError("re-encoded")):
+        assert target.load_snapshot(str(tmp_path / "snapshot")) == 2
+    assert target.alpha == 0.3
+
+    # An alpha the caller chose explicitly is kept
+    pinned = FreeBaoMemory(persist_directory=str(tmp_path / "pinned"), backend="numpy", alpha=0.05, model=HashEncoder(dim=8))
+    assert pinned.load_snapshot(str(tmp_path / "snapshot"), adopt_alpha=False) == 2
+    assert pinned.alpha == 0.05
+
+    query = "Book a flight to Paris."
+    assert target.retrieve_pareto_efficient(query, k=2) == source.retrieve_pareto_efficient(query, k=2)
+
+    other = FreeBaoMemory(persist_directory=str(tmp_path / "other"), backend="numpy", model=HashEncoder(dim=16))
+    with pytest.raises(ValueError, match="built with embedder"):
+        other.load_snapshot(str(tmp_path / "snapshot"))
+
+def test_alpha_sweep_scoring_matches_single_alpha():
+    from memory.pareto import select_pareto_sweep, weighted_order, weighted_order_sweep
+
+    rng = np.random.default_rng(3)
+    distances, turns = rng.random(40), rng.integers(1, 15, 40).astype(float)
+    alphas = [0.0, 0.05, 0.5]
+    swept = weighted_order_sweep(distances, turns, alphas)
+    for alpha, order, pareto in zip(alphas, swept, select_pareto_sweep(distances, turns, 5, alphas)):
+        assert np.array_equal(order, weighted_order(distances, turns, alpha))
+        assert np.array_equal(pareto, select_pareto(distances, turns, 5, alpha))
+
+@patch("simulation.benchmark.wandb")
+def test_alpha_sweep_reranks_one_candidate_fetch(mock_wandb, scripted_memory, scripted_runner):
+    memory = scripted_memory
+    memory.add_episodes([
+        Episode(task_description="Book a flight.", trajectory="close but slow", success=True, turns=12),
+        Episode(task_description="Book a flight to Rome.", trajectory="farther but quick", success=True, turns=1),
+    ])
+    runner = scripted_runner()
+
+    with patch.object(memory.collection, "query", wraps=memory.collection.query) as query:
+        rows = runner.run_alpha_sweep([0.0, 1.0], num_episodes=3)
+
+    query.assert_called_once()
+    assert [row["alpha"] for row in rows] == [0.0, 1.0]
+    assert rows[0]["changed_selections"] == 0 and rows[1]["changed_selections"] >= 1
+    assert all(row["success_rate"] == 1.0 for row in rows)
+    assert memory.alpha == 0.1
+
+@patch("simulation.benchmark.wandb")
+def test_alpha_sweep_over_streamed_dataset_fetches_each_chunk_once(mock_wandb, scripted_memory, scripted_runner, tmp_path):
+    path = tmp_path / "tasks.jsonl"
+    path.write_text("".join(json.dumps({"goal": "Paris", "task": f"Find hotel number {i}."}) + "\n" for i in range(4)))
+    scripted_memory.add_episodes([
+        Episode(task_description="Find hotel number 1.", trajectory="close but slow", success=True, turns=12),
+        Episode(task_description="Find a hotel.", trajectory="farther but quick", success=True, turns=1),
+    ])
+    runner = scripted_runner(dataset_path=str(path), dataset_chunk_size=2)
+
+    with patch.object(scripted_memory.collection, "query", wraps=scripted_memory.collection.query) as query, \
+            patch.object(runner.dataset, "rows", wraps=runner.dataset.rows) as rows:
+        results = runner.run_alpha_sweep([0.0, 0.5, 1.0], num_episodes=4)
+
+    # One query per chunk of 2 tasks; the three eval phases only re-rank the kept pools
+    assert query.call_count == 2
+    assert [len(call.kwargs["query_embeddings"]) for call in query.call_args_list] == [2, 2]
+    assert rows.call_count == 4
+    assert [row["alpha"] for row in results] == [0.0, 0.5, 1.0]
+    assert scripted_memory._candidate_pools == {}
+
+def test_chat_session_streams_tokens_and_keeps_state(scripted_memory):
+    from benchmarks.fakes import ScriptedAgentModel
+    from agent.session import ChatSession
+
+    memory = scripted_memory
+    session = ChatSession(FreeBaoAgent(memory, llm=ScriptedAgentModel()))
+
+    with patch.object(memory, "get_formatted_retrieval", wraps=memory.get_formatted_retrieval) as retrieve:
+        first = list(session.stream_turn("I need a hotel."))
+        second = list(session.stream_turn("Paris, tomorrow please."))
+
+    # Tokens arrive one word at a time and join up to the full reply
+    assert len(first) > 1 and {node for node, _, _ in first} == {"reason"}
+    assert "".join(text for _, _, text in first) == "Which city and which date?"
+    # The second turn continues the same thread: the agent now calls the tool
+    assert [node for node, _, _ in second][0] == "tools"
+    assert "".join(text for node, _, text in second if node == "reason") == "Done, your hotel is booked."
+    retrieve.assert_called_once()
+    assert session.last_latency["first_token_s"] <= session.last_latency["total_s"]
+
+    prefetched = ChatSession(FreeBaoAgent(memory, llm=ScriptedAgentModel()))
+    with patch.object(memory, "get_formatted_retrieval") as retrieve:
+        list(prefetched.stream_turn("I need a hotel.", retrieval={"context": "cached", "retrieval_candidates": 0}))
+    retrieve.assert_not_called()
+    assert prefetched.app.get_state(prefetched.config).values["context"] == "cached"
+
+def test_history_policy_windows_and_summarizes_incrementally():
+    from langchain_core.messages import ToolMessage
+    from agent.history import HistoryPolicy, HistoryState, summarize_message
+
+    call = AIMessage(content="", tool_calls=[{"name": "search_hotels", "args": {"location": "Paris"}, "id": "c1"}])
+    messages = [HumanMessage(content="Find me a hotel. " + "Somewhere quiet, central and close to the museums. " * 5), AIMessage(content="Which city?"),
+                HumanMessage(content="Paris."), call, ToolMessage(content="Found 3 hotels.", tool_call_id="c1")]
+    policy, state = HistoryPolicy(window=2), HistoryState()
+
+    window = policy.apply(messages, state)
+    # The window is widened so the tool result keeps its call
+    assert window == messages[3:]
+    assert state.summary == "Human: Find me a hotel.\nAI: Which city?\nHuman: Paris."
+    assert state.summarized == 3 and state.tokens_saved > 0
+
+    # Messages already folded in are not summarized again
+    with patch("agent.history.summarize_message", wraps=summarize_message) as summarize:
+        policy.apply(messages + [AIMessage(content="Booked."), HumanMessage(content="Thanks.")], state)
+    assert summarize.call_count == 2
+    assert state.summary.endswith("AI called search_hotels(location='Paris')\nTool result: Found 3 hotels.")
+
+    assert HistoryPolicy().apply(messages, HistoryState()) == messages
+    assert HistoryPolicy(window=1, summary_tokens=0).apply(messages[:3], state := HistoryState()) == messages[2:3]
+    assert state.summary == ""
+
+@patch("simulation.benchmark.wandb")
+def test_benchmark_reports_history_tokens_saved(mock_wandb, scripted_runner):
+    from agent.history import HistoryPolicy
+
+    runner = scripted_runner(history_policy=HistoryPolicy(window=3, summary_tokens=0))
+    episode = runner._run_episode(0, "eval")
+
+    trace = episode["trace"].summary()
+    assert episode["success"]
+    assert trace["reason_history_tokens_saved"] > 0
+    assert runner._trace_row(trace)[-1] == trace["reason_history_tokens_saved"] + trace.get("user_simulator_history_tokens_saved", 0)
+
+def test_jsonl_dataset_samples_and_shards_deterministically(tmp_path):
+    from simulation.datasets import JsonlDataset, ParquetDataset
+
+    path = tmp_path / "tasks.jsonl"
+    path.write_text("".join(json.dumps({"goal": f"goal {i}", "task": f"task {i}"}) + "\n" for i in range(1000)) + "\n")
+
+    full = JsonlDataset(str(path), chunk_size=64)
+    assert len(full) == 1000 and full[1003]["task"] == "task 3"
+
+    def tasks(dataset):
+        return [row["task"] for chunk in dataset.chunks() for row in chunk]
+
+    # The sample only depends on the seed, not on how the file is chunked
+    sample = tasks(JsonlDataset(str(path), sample=0.2, seed=7, chunk_size=33))
+    assert sample == tasks(JsonlDataset(str(path), sample=0.2, seed=7, chunk_size=500))
+    assert 150 < len(sample) < 250 and sample != tasks(JsonlDataset(str(path), sample=0.2, seed=8))
+
+    shards = [JsonlDataset(str(path), sample=0.2, seed=7, shard=(k, 3), chunk_size=50) for k in range(3)]
+    assert [len(shard) for shard in shards] == [len(tasks(shard)) for shard in shards]
+    assert sorted(sum((tasks(shard) for shard in shards), []), key=lambda task: int(task.split()[1])) == sample
+
+    with patch.dict("sys.modules", {"pyarrow": None, "pyarrow.parquet": None}):
+        with pytest.raises(ImportError, match="pip install pyarrow"):
+            ParquetDataset(str(tmp_path / "tasks.parquet"))
+
+def test_parquet_dataset_matches_jsonl_sampling_and_sharding(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    from simulation.datasets import JsonlDataset, ParquetDataset
+
+    rows = [{"goal": f"goal {i}", "task": f"task {i}", "source": "synthetic"} for i in range(1000)]
+    parquet_path, jsonl_path = tmp_path / "tasks.parquet", tmp_path / "tasks.jsonl"
+    # Several row groups, so batches are read across group boundaries
+    pq.write_table(pa.Table.from_pylist(rows), str(parquet_path), row_group_size=300)
+    jsonl_path.write_text("".join(json.dumps({"goal": row["goal"], "task": row["task"]}) + "\n" for row in rows))
+
+    full = ParquetDataset(str(parquet_path), chunk_size=64)
+    # Only the goal and task columns are read
+    assert len(full) == 1000 and full[1003] == {"goal": "goal 3", "task": "task 3"}
+
+    def tasks(dataset):
+        return [row["task"] for chunk in dataset.chunks() for row in chunk]
+
+    sample = tasks(ParquetDataset(str(parquet_path), sample=0.2, seed=7, chunk_size=33))
+    assert sample == tasks(JsonlDataset(str(jsonl_path), sample=0.2, seed=7, chunk_size=500))
+
+    for k in range(3):
+        shard = ParquetDataset(str(parquet_path), sample=0.2, seed=7, shard=(k, 3), chunk_size=50)
+        assert len(shard) == len(tasks(shard))
+        assert tasks(shard) == tasks(JsonlDataset(str(jsonl_path), sample=0.2, seed=7, shard=(k, 3), chunk_size=64))
+        assert [task for _, task in shard.rows(range(3))] == [{"goal": f"goal {t.split()[1]}", "task": t} for t in tasks(shard)[:3]]
+
+@patch("simulation.benchmark.wandb")
+def test_benchmark_streams_jsonl_tasks_in_chunks(mock_wandb, scripted_memory, scripted_runner, tmp_path):
+    path = tmp_path / "tasks.jsonl"
+    path.write_text("".join(json.dumps({"goal": "Paris", "task": f"Find hotel number {i}."}) + "\n" for i in range(7)))
+    runner = scripted_runner(dataset_path=str(path), dataset_chunk_size=3)
+
+    with patch.object(scripted_memory, "prefetch", wraps=scripted_memory.prefetch) as prefetch:
+        runner.run_benchmark(num_episodes=9, mode="eval", concurrency=2)
+
+    # One batched prefetch per chunk of 3 episodes; episode 7 wraps around to row 0
+    assert [len(call.args[0]) for call in prefetch.call_args_list] == [3, 3, 3]
+    records = [json.loads(line) for line in (tmp_path / "results" / "free_bao_benchmark-eval.jsonl").read_text().splitlines()]
+    assert {record["index"]: record["task"] for record in records}[7] == "Find hotel number 0."
+
+def test_ui_session_builds_from_cli_arguments(scripted_memory):
+    import main
+    from agent.history import HistoryPolicy
+    from benchmarks.fakes import ScriptedAgentModel
+
+    args = main.parse_args(["--mode", "ui", "--backend", "numpy", "--history-window", "4", "--dataset-sample", "0.5"])
+    with patch("agent.react_agent.langchain_openai.ChatOpenAI", return_value=ScriptedAgentModel()):
+        session = main.build_session(scripted_memory, args, None, HistoryPolicy(window=args.history_window))
+
+    assert "".join(text for _, _, text in session.stream_turn("I need a hotel.")) == "Which city and which date?"
+
+def test_numpy_store_serves_queries_while_another_thread_writes(tmp_path):
+    import threading
+
+    store = NumpyCollection(str(tmp_path / "store"))
+    rng = np.random.default_rng(0)
+    errors, done = [], threading.Event()
+
+    def write():
+        try:
+            # Enough rows to grow the arrays and to trigger compaction via deletes
+            for batch in range(30):
+                ids = [f"{batch}-{i}" for i in range(100)]
+                store.upsert(ids=ids, embeddings=rng.random((100, 8)), documents=ids,
+                             metadatas=[{"success": True, "turns": i % 7} for i in range(100)])
+                if batch % 3 == 2:
+                    store.delete(ids=[f"{batch - 1}-{i}" for i in range(100)])
+        except Exception as error:
+            errors.append(error)
+        finally:
+            done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                store.query(query_embeddings=np.ones((2, 8)), n_results=5, where={"success": True})
+                store.get(include=["metadatas"])
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert store.count() == 2000
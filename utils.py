@@ -1,3 +1,4 @@
+import importlib
 import os
 import re
 
@@ -22,3 +23,30 @@ def load_keys_from_bashrc():
         if match:
             os.environ[key] = match.group(1)
             print(f"Loaded {key} from .bashrc")
+
+def estimate_tokens(text: str) -> int:
+    """Rough prompt-token estimate (~4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Defers importing a heavy dependency until it is first used, so that
+    importing this package (and starting the CLI) stays fast.
+    """
+    return LazyModule(name)